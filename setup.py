@@ -9,6 +9,7 @@ setuptools.setup(
     install_requires=[
         'setuptools',
         'pandas',
+        'numpy',
         'openpyxl',
         'networkx',
         'requests',
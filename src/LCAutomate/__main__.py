@@ -1,7 +1,9 @@
 import argparse
 import sys, os
 
-from src.LCAutomate.common_simplified import DEFAULT_IMPACT_ASSESSMENT_METHOD, DEFAULT_NUMBER_OF_ITERATIONS, CalculationTypeNames
+from src.LCAutomate.common_simplified import DEFAULT_IMPACT_ASSESSMENT_METHOD, DEFAULT_NUMBER_OF_ITERATIONS, DEFAULT_IPC_PORT, DEFAULT_WORKERS, DEFAULT_POLL_TIMEOUT, \
+    DEFAULT_UPSTREAM_MAX_DEPTH, DEFAULT_UPSTREAM_MIN_SHARE, DEFAULT_UPSTREAM_MAX_NODES, \
+    STATE_BACKEND_PICKLE, STATE_BACKEND_SQLITE, CalculationTypeNames
 from src.olca__patched import ipc as olca
 
 from src.LCAutomate.model.model import Model
@@ -10,6 +12,13 @@ from src.LCAutomate.calculation.calculation import Calculation
 from src.LCAutomate.product_system.product_system import ProductSystem
 
 
+def port_list(value: str) -> list:
+    try:
+        return [int(port) for port in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a comma-separated list of ports")
+
+
 def main():
     parser = argparse.ArgumentParser(prog="LCAutomate")
 
@@ -31,6 +40,23 @@ def main():
                         help=f"Impact assessment method for the calculation operation (default '{DEFAULT_IMPACT_ASSESSMENT_METHOD}')")
     parser.add_argument("-n", "--number-of-iterations", type=int, default=DEFAULT_NUMBER_OF_ITERATIONS,
                         help=f"Number of iterations for Monte Carlo simulation (default {DEFAULT_NUMBER_OF_ITERATIONS}) (ignored for other calculation types)")
+    parser.add_argument("-p", "--ports", type=port_list, default=[DEFAULT_IPC_PORT],
+                        help=f"Comma-separated ports of the OpenLCA IPC servers (default {DEFAULT_IPC_PORT}), the calculation operation "
+                             f"spreads its calculations across all of them, the other operations use the first")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of calculations kept in flight on each IPC server for the calculation operation (default {DEFAULT_WORKERS})")
+    parser.add_argument("--poll-timeout", type=float, default=DEFAULT_POLL_TIMEOUT,
+                        help=f"Number of seconds after which waiting for a calculation result is given up, 0 for no limit (default {DEFAULT_POLL_TIMEOUT})")
+    parser.add_argument("--upstream-max-depth", type=int, default=DEFAULT_UPSTREAM_MAX_DEPTH,
+                        help=f"Number of levels expanded below the top-level processes in the upstream results (default {DEFAULT_UPSTREAM_MAX_DEPTH})")
+    parser.add_argument("--upstream-min-share", type=float, default=DEFAULT_UPSTREAM_MIN_SHARE,
+                        help=f"Minimum contribution, in percent of the impact category total, of a process to be expanded in the upstream results (default {DEFAULT_UPSTREAM_MIN_SHARE})")
+    parser.add_argument("--upstream-max-nodes", type=int, default=DEFAULT_UPSTREAM_MAX_NODES,
+                        help="Maximum number of processes expanded per impact category in the upstream results, largest contributions first (default no limit)")
+    parser.add_argument("--upstream-shared-tree", action="store_true", default=False,
+                        help="Export one upstream tree with the results of all impact categories per node instead of one tree per impact category; saves the requests for processes without upstream processes, and with --upstream-min-share for the impact categories in which a process is not relevant (default False)")
+    parser.add_argument("--state-backend", type=str, choices=[STATE_BACKEND_PICKLE, STATE_BACKEND_SQLITE], default=STATE_BACKEND_PICKLE,
+                        help=f"Storage of the state between the operations, '{STATE_BACKEND_SQLITE}' also lets several calculation processes share it (default '{STATE_BACKEND_PICKLE}')")
 
     # This is required to do pre-parsing of the arguments because argparse can't handle an argument value containing spaces!
     keywords = [
@@ -40,6 +66,14 @@ def main():
         "-c", "--calculation-type",
         "-im", "--impact-assessment-method",
         "-n", "--number-of-iterations",
+        "-p", "--ports",
+        "-w", "--workers",
+        "--poll-timeout",
+        "--upstream-max-depth",
+        "--upstream-min-share",
+        "--upstream-max-nodes",
+        "--upstream-shared-tree",
+        "--state-backend",
     ]
 
 
@@ -80,26 +114,69 @@ def main():
         print(f"args.impact_assessment_method: {args.impact_assessment_method}")
         if args.calculation_type == CalculationTypeNames.MONTE_CARLO_SIMULATION:
             print(f"args.number_of_iterations: {args.number_of_iterations}")
+        print(f"args.workers: {args.workers}")
+        print(f"args.poll_timeout: {args.poll_timeout}")
+        print(f"args.upstream_max_depth: {args.upstream_max_depth}")
+        print(f"args.upstream_min_share: {args.upstream_min_share}")
+        print(f"args.upstream_max_nodes: {args.upstream_max_nodes}")
+        print(f"args.upstream_shared_tree: {args.upstream_shared_tree}")
+    print(f"args.ports: {args.ports}")
+    print(f"args.state_backend: {args.state_backend}")
+
+    if args.workers < 1:
+        print("ERROR: --workers must be at least 1")
+        sys.exit(1)
+
+    if args.poll_timeout < 0:
+        print("ERROR: --poll-timeout must not be negative")
+        sys.exit(1)
+
+    if args.upstream_max_depth < 0:
+        print("ERROR: --upstream-max-depth must not be negative")
+        sys.exit(1)
 
-    client = olca.Client(8080)
+    upstream_limits = olca.UpstreamLimits(
+        max_depth=args.upstream_max_depth,
+        min_share=args.upstream_min_share / 100.0,
+        max_nodes=args.upstream_max_nodes
+    )
+
+    # Keep enough pooled connections for all workers on a server
+    poll_timeout = args.poll_timeout if args.poll_timeout > 0 else None
+    clients = [
+        olca.Client(port, pool_size=max(10, args.workers), poll_timeout=poll_timeout, upstream_limits=upstream_limits)
+        for port in args.ports
+    ]
+    client = clients[0]
     if args.operation == "model":
-        module = Model(client, args.input_root_folder, args.restart)
+        module = Model(client, args.input_root_folder, args.restart, args.state_backend)
     elif args.operation == "process-hierarchy":
-        module = ProcessHierarchy(client, args.input_root_folder, args.restart)
+        module = ProcessHierarchy(client, args.input_root_folder, args.restart, args.state_backend)
     elif args.operation == "product-system":
-        module = ProductSystem(client, args.input_root_folder, args.restart)
+        module = ProductSystem(client, args.input_root_folder, args.restart, args.state_backend)
     elif args.operation == "calculation":
         module = Calculation(
             client, args.input_root_folder, args.restart, 
             args.calculation_type, 
             args.impact_assessment_method, 
-            args.number_of_iterations
+            args.number_of_iterations,
+            clients,
+            args.workers,
+            args.upstream_shared_tree,
+            args.state_backend
         )
     else:
         print(f"ERROR: Unrecognized operation: {args.operation}")
         sys.exit(1)
 
-    done = module.do()
+    try:
+        done = module.do()
+    finally:
+        # Release the pooled connections also when the operation raised
+        for client in clients:
+            client.close()
+            if client.failure_counts:
+                print(f"\nIPC failures by method ({client.url}): {dict(client.failure_counts)}")
     sys.exit(0) if done else sys.exit(1)
 
 
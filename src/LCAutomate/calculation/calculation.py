@@ -1,13 +1,18 @@
 import os
 import shutil
 import json
+import threading
+from src.LCAutomate.calculation.scheduler import WorkStealingScheduler
 from src.LCAutomate.common_simplified import (
     DEFAULT_IMPACT_ASSESSMENT_METHOD, 
     DEFAULT_NUMBER_OF_ITERATIONS, 
+    DEFAULT_WORKERS,
+    STATE_BACKEND_PICKLE,
+    STATE_BACKEND_SQLITE,
     CalculationTypeNames
 )
 from src.LCAutomate.model.template_process import TemplateProcessShortEncoder
-from src.LCAutomate.state import State
+from src.LCAutomate.state import create_state
 from src.olca__patched import ipc as olca
 from src.olca__patched import schema as olca_schema
 
@@ -19,9 +24,19 @@ class Calculation:
             restart: bool, 
             calculation_type: str = CalculationTypeNames.UPSTREAM_ANALYSIS,
             impact_assessment_method: str = DEFAULT_IMPACT_ASSESSMENT_METHOD,
-            number_of_iterations: int = DEFAULT_NUMBER_OF_ITERATIONS
+            number_of_iterations: int = DEFAULT_NUMBER_OF_ITERATIONS,
+            clients: list = None,
+            workers: int = DEFAULT_WORKERS,
+            upstream_shared_tree: bool = False,
+            state_backend: str = STATE_BACKEND_PICKLE
         ):
         self.client = client
+        # One client per openLCA IPC server; the replicants are spread across all of them
+        self.clients = clients if clients else [client]
+        # Number of calculations kept in flight on each IPC server
+        self.workers = workers
+        # Export one upstream tree with the results of all impact categories instead of one tree per category
+        self.upstream_shared_tree = upstream_shared_tree
         self.base_root_folder = input_root_folder
         self.restart = restart
         self.calculation_type = calculation_type
@@ -34,7 +49,9 @@ class Calculation:
         self.output_root_folder_path = os.path.join(self.base_root_folder_path, self.calculation_folder_path)
         self.top_level_process_uuid = None
         self.template_processes = {}
-        self.state = State(self.base_root_folder)
+        self.state_backend = state_backend
+        self.state = create_state(self.base_root_folder, state_backend)
+        self.state_lock = threading.Lock()
 
     def do(self) -> bool:
         if self.restart:
@@ -68,6 +85,12 @@ class Calculation:
         print(f"\nCreating output root folder {self.calculation_folder_path}, if necessary", flush=True)
         os.makedirs(self.output_root_folder_path, exist_ok=True)
 
+        if self.state_backend == STATE_BACKEND_SQLITE:
+            # Other calculation processes sharing the state may be writing files for replicants they claimed and have
+            # not recorded yet, so the stale files are removed per replicant when it is claimed, see remove_stale_files
+            print("File removal step skipped, stale files are removed when their replicant is calculated", flush=True)
+            return
+
         state_files = []
         top_level_replicants = self.template_processes[self.top_level_process_uuid].replicants
         for replicant in top_level_replicants.values():
@@ -106,8 +129,26 @@ class Calculation:
         # with open(os.path.join(self.input_root_folder_path, "process-hierarchy.json"), "r") as f:
         #     process_hierarchy = json.load(f)
 
+        pending_replicants = []
         top_level_replicants = self.template_processes[self.top_level_process_uuid].replicants
-        for data_column_name, replicant in top_level_replicants.items():
+
+        # The SQLite backend returns just the replicants without calculation files
+        pending_data_column_names = self.state.get_pending_replicants(
+            self.top_level_process_uuid, self.calculation_type, self.impact_assessment_method
+        )
+        if pending_data_column_names is None:
+            pending_data_column_names = list(top_level_replicants.keys())
+        else:
+            pending_data_column_names = [data_column_name for data_column_name in pending_data_column_names
+                                         if data_column_name in top_level_replicants]
+            done_count = len(top_level_replicants) - len(pending_data_column_names)
+            if done_count > 0:
+                print(f"Calculation files for {done_count} data column(s) "
+                      f"'{self.calculation_type}' - '{self.impact_assessment_method}' already created",
+                      flush=True)
+
+        for data_column_name in pending_data_column_names:
+            replicant = top_level_replicants.get(data_column_name, None)
             if replicant is None:
                 replicant = {}
 
@@ -129,69 +170,109 @@ class Calculation:
                               flush=True
                         )
                         continue
-            
-            print('\nCalculations for: \033[1m' + product_system_name, '\033[0m', flush=True)
-            
-            impact_method = self.client.find(olca_schema.ImpactMethod, self.impact_assessment_method)
-            print(f"Getting product system '{product_system_name}' ({product_system_uuid})...", flush=True)
-            product_system = self.client.get(olca_schema.ProductSystem, product_system_uuid)
-
-            setup = olca_schema.CalculationSetup(
-                calculation_type   =  CalculationTypeNames.get_olca_calculation_type(self.calculation_type),
-                allocation_method  =  olca_schema.AllocationType.PHYSICAL,
-                impact_method      =  impact_method,
-                product_system     =  product_system,
-                amount             =  1.0,
-                with_costs         =  False
-            )
 
-            print(f"Doing '{self.calculation_type}' calculation with impact assessment method '{self.impact_assessment_method}'...", flush=True)
-            if self.calculation_type == CalculationTypeNames.MONTE_CARLO_SIMULATION:
-                # Monte Carlo simulation
-                simulator_response, err = self.client.simulator(setup)
-                if err is not None:
-                    print(f"ERROR: client.simulator() returned error '{err}'")
-                    return False
-                else:
-                    simulator = olca_schema.Ref.from_json(simulator_response)
-                    for i in range(self.number_of_iterations):
-                        print('\n\033[1m' + product_system_name, f'(iteration {i + 1})\033[0m', flush=True)
-                        result, err = self.client.next_simulation(simulator)
-                        if err is not None:
-                            print(f"ERROR: client.next_simulation() returned error '{err}'")
+            pending_replicants.append((data_column_name, replicant))
+
+        # Calculations are spread across the IPC servers, with self.workers calculations in flight on each;
+        # state updates are serialized by the state lock
+        scheduler_workers = [client for _ in range(self.workers) for client in self.clients]
+        if len(scheduler_workers) > 1:
+            print(f"\nRunning {len(pending_replicants)} calculation(s) with {self.workers} worker(s) "
+                  f"on each of {len(self.clients)} IPC server(s)", flush=True)
+        scheduler = WorkStealingScheduler(scheduler_workers)
+        return scheduler.run(pending_replicants, self.calculate_replicant)
+
+    def calculate_replicant(self, client: olca.Client, pending_replicant: tuple) -> bool:
+        data_column_name, replicant = pending_replicant
+
+        # Other LCAutomate processes may share the state (SQLite backend) and calculate replicants concurrently
+        claimed = self.state.claim_replicant(
+            self.top_level_process_uuid, data_column_name, self.calculation_type, self.impact_assessment_method
+        )
+        if not claimed:
+            print(f"Calculation for data column '{data_column_name}' claimed or done by another process, skipped", flush=True)
+            return True
+        try:
+            self.remove_stale_files(data_column_name)
+            return self.calculate_claimed_replicant(client, data_column_name, replicant)
+        finally:
+            self.state.release_replicant(self.top_level_process_uuid, data_column_name)
+
+    def remove_stale_files(self, data_column_name: str):
+        # Remove the files left for this replicant by an earlier, interrupted calculation; it is not recorded in the
+        # state, so they are overwritten anyway, but must not be taken for results while it is calculated
+        for calculation_filepath in self.get_calculation_filepaths(data_column_name).values():
+            if os.path.isfile(calculation_filepath):
+                print(f"Removing file: {os.path.basename(calculation_filepath)}")
+                os.unlink(calculation_filepath)
+
+    def calculate_claimed_replicant(self, client: olca.Client, data_column_name: str, replicant: dict) -> bool:
+        product_system_name = replicant.get("product_system_name", None)
+        product_system_uuid = replicant.get("product_system_uuid", None)
+
+        print('\nCalculations for: \033[1m' + product_system_name, '\033[0m', flush=True)
+        
+        impact_method = client.find(olca_schema.ImpactMethod, self.impact_assessment_method)
+        print(f"Getting product system '{product_system_name}' ({product_system_uuid})...", flush=True)
+        product_system = client.get(olca_schema.ProductSystem, product_system_uuid)
+
+        setup = olca_schema.CalculationSetup(
+            calculation_type   =  CalculationTypeNames.get_olca_calculation_type(self.calculation_type),
+            allocation_method  =  olca_schema.AllocationType.PHYSICAL,
+            impact_method      =  impact_method,
+            product_system     =  product_system,
+            amount             =  1.0,
+            with_costs         =  False
+        )
+
+        print(f"Doing '{self.calculation_type}' calculation with impact assessment method '{self.impact_assessment_method}'...", flush=True)
+        if self.calculation_type == CalculationTypeNames.MONTE_CARLO_SIMULATION:
+            # Monte Carlo simulation
+            simulator_response, err = client.simulator(setup)
+            if err is not None:
+                print(f"ERROR: client.simulator() returned error '{err}'")
+                return False
+            else:
+                simulator = olca_schema.Ref.from_json(simulator_response)
+                for i in range(self.number_of_iterations):
+                    print('\n\033[1m' + product_system_name, f'(iteration {i + 1})\033[0m', flush=True)
+                    result, err = client.next_simulation(simulator)
+                    if err is not None:
+                        print(f"ERROR: client.next_simulation() returned error '{err}'")
+                        return False
+                    else:
+                        result_id = result.get('@id')
+                        base_name = f"{product_system_name} - {i}"
+                        exported = self.export_results(client, result_id, base_name)
+                        if not exported:
+                            client.dispose(simulator_response)
                             return False
-                        else:
-                            result_id = result.get('@id')
-                            base_name = f"{product_system_name} - {i}"
-                            exported = self.export_results(result_id, base_name)
-                            if not exported:
-                                self.client.dispose(simulator_response)
-                                return False
 
-                self.client.dispose(simulator_response)
+            client.dispose(simulator_response)
 
+        else:
+            # Regular calculation
+            result, err = client.calculate(setup)
+            if err is not None:
+                print(f"ERROR: client.calculate() returned error '{err}'")
+                return False
             else:
-                # Regular calculation
-                result, err = self.client.calculate(setup)
-                if err is not None:
-                    print(f"ERROR: client.calculate() returned error '{err}'")
+                result_id = result.get('@id')
+                base_name = product_system_name
+                exported = self.export_results(client, result_id, base_name)
+                client.dispose(result)
+                if not exported:
                     return False
-                else:
-                    result_id = result.get('@id')
-                    base_name = product_system_name
-                    exported = self.export_results(result_id, base_name)
-                    self.client.dispose(result)
-                    if not exported:
-                        return False
 
-            filepaths = self.get_calculation_filepaths(data_column_name)
+        filepaths = self.get_calculation_filepaths(data_column_name)
+        with self.state_lock:
             if replicant.get("calculation_files", None) is None:
                 replicant["calculation_files"] = {}
             if replicant["calculation_files"].get(self.calculation_type, None) is None:
                 replicant["calculation_files"][self.calculation_type] = {}
             replicant["calculation_files"][self.calculation_type][self.impact_assessment_method] = filepaths
 
-            state_saved = self.save_state()
+            state_saved = self.state.append(self.top_level_process_uuid, data_column_name, replicant)
             if not state_saved:
                 print(f"ERROR: Failed to save state to {self.state.filepath}")
                 return False
@@ -210,20 +291,26 @@ class Calculation:
                 calculation_filepaths[f"flows-of-impact-category - {i}"] = f"{base}-result-flows-of-impact-category.json"
                 calculation_filepaths[f"total-flows - {i}"] = f"{base}-result-total-flows.json"
                 calculation_filepaths[f"total-impacts - {i}"] = f"{base}-result-total-impacts.json"
-                calculation_filepaths[f"upstream-of-impact-category - {i}"] = f"{base}-result-upstream-of-impact-category.json"
+                if self.upstream_shared_tree:
+                    calculation_filepaths[f"upstream-tree - {i}"] = f"{base}-result-upstream-tree.json"
+                else:
+                    calculation_filepaths[f"upstream-of-impact-category - {i}"] = f"{base}-result-upstream-of-impact-category.json"
         else:
             base = f"{base_filepath} - {data_column_name}"
             calculation_filepaths = {
                 "flows-of-impact-category": f"{base}-result-flows-of-impact-category.json",
                 "total-flows": f"{base}-result-total-flows.json",
                 "total-impacts": f"{base}-result-total-impacts.json",
-                "upstream-of-impact-category": f"{base}-result-upstream-of-impact-category.json",
             }
+            if self.upstream_shared_tree:
+                calculation_filepaths["upstream-tree"] = f"{base}-result-upstream-tree.json"
+            else:
+                calculation_filepaths["upstream-of-impact-category"] = f"{base}-result-upstream-of-impact-category.json"
         return calculation_filepaths
 
-    def export_results(self, result_id, base_name) -> bool:
+    def export_results(self, client: olca.Client, result_id, base_name) -> bool:
         print('client.json_export_result_detail("result/total-impacts")', flush=True)
-        data, err = self.client.json_export_result_detail("result/total-impacts", {"@id": result_id}, self.output_root_folder_path, base_name)
+        data, err = client.json_export_result_detail("result/total-impacts", {"@id": result_id}, self.output_root_folder_path, base_name)
         if err is not None:
             print(f"ERROR: client.json_export_result_detail('result/total-impacts') returned error '{err}'")
             return False
@@ -232,11 +319,15 @@ class Calculation:
                 "@id": result_id,
                 "totalImpacts": data
             }
-            print('client.json_export_upstream_of_impact_category()', flush=True)
-            self.client.json_export_upstream_of_impact_category(impact_params, self.output_root_folder_path, base_name)
+            if self.upstream_shared_tree:
+                print('client.json_export_shared_upstream_tree()', flush=True)
+                client.json_export_shared_upstream_tree(impact_params, self.output_root_folder_path, base_name)
+            else:
+                print('client.json_export_upstream_of_impact_category()', flush=True)
+                client.json_export_upstream_of_impact_category(impact_params, self.output_root_folder_path, base_name)
 
             print('client.json_export_result_detail("result/total-flows")', flush=True)
-            data, err = self.client.json_export_result_detail(
+            data, err = client.json_export_result_detail(
                 "result/total-flows", {"@id": result_id}, self.output_root_folder_path, base_name
             )
             if err is not None:
@@ -244,7 +335,7 @@ class Calculation:
                 return False
             else:
                 print('client.json_export_flows_of_impact_category()', flush=True)
-                self.client.json_export_flows_of_impact_category(impact_params, self.output_root_folder_path, base_name)
+                client.json_export_flows_of_impact_category(impact_params, self.output_root_folder_path, base_name)
                 # TODO: Isn't there an error path here?
 
         return True
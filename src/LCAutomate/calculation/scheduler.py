@@ -0,0 +1,66 @@
+import threading
+import traceback
+from collections import deque
+from typing import Any, Callable
+
+
+class WorkStealingScheduler:
+    """
+    Runs tasks on a fixed set of workers, e.g. one IPC client per openLCA server.
+
+    The tasks are dealt round-robin into one queue per worker.  A worker takes tasks from the front of its own
+    queue and, when that is empty, steals from the back of the longest other queue, so a fast server keeps busy
+    while a slow one works through long calculations.
+    """
+    def __init__(self, workers: list):
+        self.workers = workers
+        self.queues = [deque() for _ in workers]
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.failed = False
+
+    def run(self, tasks: list, fn: Callable[[Any, Any], bool]) -> bool:
+        # fn(worker, task) returns False on failure, which stops the scheduling of further tasks
+        self.failed = False
+        self.stopped.clear()
+        for i, task in enumerate(tasks):
+            self.queues[i % len(self.workers)].append(task)
+
+        if len(self.workers) == 1:
+            self.work(0, fn)
+        else:
+            threads = []
+            for worker_index in range(len(self.workers)):
+                thread = threading.Thread(target=self.work, args=(worker_index, fn), daemon=True)
+                threads.append(thread)
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return not self.failed
+
+    def work(self, worker_index: int, fn: Callable[[Any, Any], bool]):
+        worker = self.workers[worker_index]
+        while not self.stopped.is_set():
+            task = self.next_task(worker_index)
+            if task is None:
+                return
+            try:
+                done = fn(worker, task)
+            except Exception as e:
+                print(f"ERROR: {e}", flush=True)
+                traceback.print_exc()
+                done = False
+            if not done:
+                self.failed = True
+                self.stopped.set()
+
+    def next_task(self, worker_index: int):
+        with self.lock:
+            own_queue = self.queues[worker_index]
+            if own_queue:
+                return own_queue.popleft()
+            victim_queue = max(self.queues, key=len)
+            if victim_queue:
+                return victim_queue.pop()
+            return None
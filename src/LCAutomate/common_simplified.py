@@ -4,6 +4,14 @@ from src.olca__patched.schema import CalculationType
 
 DRIVER_FILENAME = "Processes to be replicated.xlsx"
 STATE_FILENAME = "state.dat"
+STATE_DB_FILENAME = "state.db"
+
+# Cache folder, in the input root folder
+CACHE_FOLDER_NAME = "__cache__"
+
+# State backends
+STATE_BACKEND_PICKLE = "pickle"
+STATE_BACKEND_SQLITE = "sqlite"
 
 # Flow directions
 INPUT = "Input"
@@ -13,6 +21,21 @@ OUTPUT = "Output"
 DEFAULT_IMPACT_ASSESSMENT_METHOD = "CML-IA baseline"
 DEFAULT_NUMBER_OF_ITERATIONS = 10
 
+# Default OpenLCA IPC server port
+DEFAULT_IPC_PORT = 8080
+
+# Default number of calculations in flight on each IPC server
+DEFAULT_WORKERS = 1
+
+# Default number of seconds after which waiting for a calculation result is given up (0 for no limit)
+DEFAULT_POLL_TIMEOUT = 24 * 3600
+
+# Default limits of the upstream export: expanded levels, minimum contribution share (in percent of the category total)
+# and maximum number of expanded tech flows per impact category (None for no limit)
+DEFAULT_UPSTREAM_MAX_DEPTH = 2
+DEFAULT_UPSTREAM_MIN_SHARE = 0.0
+DEFAULT_UPSTREAM_MAX_NODES = None
+
 # LCAutomate driver file
 class DriverTabNames:
     MAIN = "Main"
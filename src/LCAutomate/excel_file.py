@@ -1,25 +1,38 @@
+import hashlib
+import json
 import os
+import pickle
 import pandas
 
+from src.LCAutomate.common_simplified import CACHE_FOLDER_NAME
+from src.LCAutomate.excel_writer import write_sheets
+
 
 class ExcelFile:
-    def __init__(self, filepath: str, column_names: list):
+    def __init__(self, filepath: str, column_names: list, use_cache: bool = True):
         self.filepath = filepath
         self.column_names = column_names
+        self.use_cache = use_cache
         self.validation_errors = []
         self.sheets = {}
+        # Parsed DQIs of the DQIs sheet by DQI column name, see DQI.reformat_dqis_sheet_df
+        self.parsed_dqis = {}
 
     def load(self) -> bool:
         self.validation_errors = []
         if not os.path.isfile(self.filepath):
             self.validation_errors.append(f"ERROR: '{self.filepath}' does not exist")
             return False
-        
-        try:
-            sheets = pandas.read_excel(self.filepath, sheet_name=None, engine="openpyxl")
-        except Exception as e:
-            self.validation_errors.append(f"ERROR: Could not read '{self.filepath}' as Excel file")
-            return False
+
+        sheets = self.load_cached_sheets() if self.use_cache else None
+        if sheets is None:
+            try:
+                sheets = pandas.read_excel(self.filepath, sheet_name=None, engine="openpyxl")
+            except Exception as e:
+                self.validation_errors.append(f"ERROR: Could not read '{self.filepath}' as Excel file")
+                return False
+            if self.use_cache:
+                self.save_cached_sheets(sheets)
 
         # Check column names
         for sheet_name, sheet_df in sheets.items():
@@ -27,10 +40,70 @@ class ExcelFile:
                 if sheet_df.get(column_name, None) is None:
                     self.validation_errors.append(f"ERROR: Sheet '{sheet_name}' in '{self.filepath}' must contain column '{column_name}'")
                     return False
-            
+
         self.sheets = sheets
         return True
-    
+
+    # Parse cache:
+    #   - the parsed sheets are pickled (pandas' own binary format, no extra dependency) to
+    #     <file folder>/__cache__/parsed/<sha256 of the file content>.pkl, so an unchanged workbook is not parsed again
+    #   - <file name>.json in the same folder remembers the modification time, size and content hash of the file, so the
+    #     content is only hashed again after the file was touched; the sheets of the previous content are then removed
+    def get_cache_folder_path(self) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.filepath)), CACHE_FOLDER_NAME, "parsed")
+
+    def get_content_hash(self) -> str:
+        stat = os.stat(self.filepath)
+        index_filepath = os.path.join(self.get_cache_folder_path(), f"{os.path.basename(self.filepath)}.json")
+        previous_content_hash = None
+        try:
+            with open(index_filepath, "r") as f:
+                index = json.load(f)
+            if index["mtime_ns"] == stat.st_mtime_ns and index["size"] == stat.st_size:
+                return index["sha256"]
+            previous_content_hash = index["sha256"]
+        except Exception:
+            pass
+
+        sha = hashlib.sha256()
+        with open(self.filepath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        content_hash = sha.hexdigest()
+        try:
+            os.makedirs(self.get_cache_folder_path(), exist_ok=True)
+            with open(index_filepath, "w") as f:
+                json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": content_hash}, f)
+        except Exception:
+            pass
+        if previous_content_hash is not None and previous_content_hash != content_hash:
+            # The file changed, so the sheets parsed from its previous content are not used again
+            try:
+                os.unlink(os.path.join(self.get_cache_folder_path(), f"{previous_content_hash}.pkl"))
+            except Exception:
+                pass
+        return content_hash
+
+    def load_cached_sheets(self) -> dict:
+        try:
+            cache_filepath = os.path.join(self.get_cache_folder_path(), f"{self.get_content_hash()}.pkl")
+            with open(cache_filepath, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # Not cached yet, or written by an incompatible pandas version: parse the workbook again
+            return None
+
+    def save_cached_sheets(self, sheets: dict):
+        try:
+            cache_filepath = os.path.join(self.get_cache_folder_path(), f"{self.get_content_hash()}.pkl")
+            temp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+            with open(temp_filepath, "wb") as f:
+                pickle.dump(sheets, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_filepath, cache_filepath)
+        except Exception:
+            # The cache is optional, e.g. the folder may be read-only
+            pass
+
     def save(self, sheets: list) -> bool:
         # Check column names
         for sheet_name, sheet_df in sheets.items():
@@ -42,10 +115,9 @@ class ExcelFile:
         self.sheets = sheets
 
         try:
-            with pandas.ExcelWriter(self.filepath) as writer:
-                for sheet_name, sheet_df in self.sheets.items():
-                    sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                return True
+            # Streamed row by row, see excel_writer
+            write_sheets(self.filepath, self.sheets)
+            return True
         except Exception as e:
-            self.validation_errors.append(f"ERROR: Error on pandas.ExcelWriter.to_excel() call: {e}")
+            self.validation_errors.append(f"ERROR: Error on writing Excel file: {e}")
             return False
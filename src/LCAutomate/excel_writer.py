@@ -0,0 +1,59 @@
+import os
+
+from typing import Iterator, Tuple
+
+import openpyxl
+import pandas
+
+
+# Streaming Excel writer
+#   - the workbook is opened in openpyxl's write-only mode and each sheet is written row by row from an iterator, so the
+#     memory use does not grow with the number of rows and columns
+#   - a sheet is given as (header, rows): the column names and an iterable of row value sequences, see dataframe_rows()
+#     and column_rows() for the two sheet representations used in LCAutomate
+
+
+def dataframe_rows(sheet_df: pandas.DataFrame) -> Tuple[list, Iterator[tuple]]:
+    return list(sheet_df.columns), sheet_df.itertuples(index=False, name=None)
+
+
+def column_rows(sheet: dict) -> Tuple[list, Iterator[tuple]]:
+    # Column-oriented sheet: {column name: [values in row order]}; like pandas.DataFrame.from_dict, all columns must
+    # have the same length
+    lengths = {len(values) for values in sheet.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"All columns must be of the same length, got lengths {sorted(lengths)}")
+    return list(sheet.keys()), zip(*sheet.values())
+
+
+def cell_value(value):
+    # Like pandas.DataFrame.to_excel, missing values (None, NaN, NaT, pandas.NA) are written as empty cells
+    if pandas.api.types.is_scalar(value) and pandas.isna(value):
+        return None
+    return value
+
+
+def write_workbook(filepath: str, sheets: dict):
+    # Write {sheet name: (header, rows)} to a new workbook, replacing the file atomically when it is complete
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, (header, rows) in sheets.items():
+        worksheet = workbook.create_sheet(title=sheet_name)
+        worksheet.append([cell_value(value) for value in header])
+        for row in rows:
+            worksheet.append([cell_value(value) for value in row])
+
+    temp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        workbook.save(temp_filepath)
+        os.replace(temp_filepath, filepath)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.unlink(temp_filepath)
+
+
+def write_sheets(filepath: str, sheets: dict):
+    # Write {sheet name: DataFrame or column-oriented dict}
+    write_workbook(filepath, {
+        sheet_name: dataframe_rows(sheet) if isinstance(sheet, pandas.DataFrame) else column_rows(sheet)
+        for sheet_name, sheet in sheets.items()
+    })
@@ -1,8 +1,10 @@
 import pandas
+from collections import Counter
 from src.olca__patched import ipc as olca
 from src.olca__patched import schema as olca_schema
 
 from src.LCAutomate.common_simplified import ReplicationColumnNames
+from src.LCAutomate.model.marker_index import ANY, normalize
 
 
 RC = ReplicationColumnNames
@@ -12,28 +14,28 @@ class AllocationMatcher:
 
     @staticmethod
     def get_matched_allocation_index_list(client: olca.Client, openlca_process: olca_schema.Process, allocations_sheet_df: pandas.DataFrame) -> list:
-        matched_allocation_index_list = []
-
         allocation_markers = AllocationMatcher.get_allocation_markers(client, openlca_process)
-        for i in range(allocations_sheet_df.index.size):
-            flow_name = allocations_sheet_df[RC.FLOW][i]
-            category = allocations_sheet_df[RC.CATEGORY][i]
+        if allocation_markers is None:
+            return None
+
+        # Hash join of the Physical Allocations rows on the allocation markers, see get_allocation_marker_index
+        allocation_marker_index = AllocationMatcher.get_allocation_marker_index(allocation_markers)
+        matched_allocation_index_list = []
 
+        flow_names = allocations_sheet_df[RC.FLOW].tolist()
+        categories = allocations_sheet_df[RC.CATEGORY].tolist()
+        for flow_name, category in zip(flow_names, categories):
             # Find test matching allocation(s)
-            test_allocation_matches = []
-            test_allocation_match_indices = []
-            for allocation_index, allocation_marker in enumerate(allocation_markers):
-                match = AllocationMatcher.is_allocation_match(allocation_marker, flow_name, category)
-                if match:
-                    test_allocation_matches.append(allocation_marker)
-                    test_allocation_match_indices.append(allocation_index)
+            test_allocation_match_indices = AllocationMatcher.find_allocation_matches(
+                allocation_marker_index, flow_name, category
+            )
         
-            if len(test_allocation_matches) == 0:
+            if len(test_allocation_match_indices) == 0:
                 matched_allocation_index_list.append(None)
-            elif len(test_allocation_matches) == 1:
+            elif len(test_allocation_match_indices) == 1:
                 matched_allocation_index_list.append(test_allocation_match_indices[0])
             else:
-                print(f"ERROR: Found {len(test_allocation_matches)} Physical Allocation matches for '{openlca_process.name}': "
+                print(f"ERROR: Found {len(test_allocation_match_indices)} Physical Allocation matches for '{openlca_process.name}': "
                       f"flow='{flow_name}', category='{category}'")
                 return None
 
@@ -43,15 +45,20 @@ class AllocationMatcher:
     def get_allocation_markers(client: olca.Client, openlca_process: olca_schema.Process) -> list:
         # We assume that for Physical Allocations the Product is a Flow
         physical_allocation_factors = []
-        for allocation_factor in openlca_process.allocation_factors:
+        for allocation_factor in openlca_process.allocation_factors or []:
             if allocation_factor.allocation_type == olca_schema.AllocationType.PHYSICAL:
                 physical_allocation_factors.append(allocation_factor)
         
         flow_names = []
         categories = []
-        for allocation in physical_allocation_factors:
+        flows = client.get_many(
+            olca_schema.Flow, [allocation.product.id for allocation in physical_allocation_factors], cached=True
+        )
+        for allocation, (flow, err) in zip(physical_allocation_factors, flows):
+            if flow is None:
+                print(f"ERROR: Flow '{allocation.product.name}' ({allocation.product.id}) of '{openlca_process.name}' is not found in OpenLCA DB: {err}")
+                return None
             flow_names.append(allocation.product.name)
-            flow = client.get(olca_schema.Flow, allocation.product.id)
             category_ref = flow.category
             if category_ref is None:
                 category = ""
@@ -60,21 +67,17 @@ class AllocationMatcher:
             category_path = "/".join(category)
             categories.append(category_path)
 
+        # An allocation factor is marked by its product name, plus its category if the product name is not unique
+        flow_name_counts = Counter(flow_names)
+        flow_name_category_counts = Counter(zip(flow_names, categories))
+
         allocation_markers = []
         for i, flow_name in enumerate(flow_names):
             category_path = None
 
-            duplicate = False
-            for j in range(len(flow_names)):
-                if i != j and flow_name == flow_names[j]:
-                    duplicate = True
-            if duplicate:
-                duplicate = False
+            if flow_name_counts[flow_name] > 1:
                 category_path = categories[i]
-                for j in range(len(flow_names)):
-                    if i != j and flow_name == flow_names[j] and category_path == categories[j]:
-                        duplicate = True
-                if duplicate:
+                if flow_name_category_counts[(flow_name, category_path)] > 1:
                     print(f"ERROR: The combination\n"
                             f"  - Flow: '{flow_name}'\n"
                             f"  - Category '{category_path}'\n"
@@ -89,19 +92,23 @@ class AllocationMatcher:
         return allocation_markers
 
     @staticmethod
-    def is_allocation_match(allocation_marker: dict, flow_name: str, flow_category: str) -> bool:
-        # TODO: Provide detailed information on misses - is this still necessary?
-        flow_match = False
-        category_match = False
+    def get_allocation_marker_index(allocation_markers: list) -> dict:
+        # Index of the allocation indices by (product name, category) on stripped values; a marker without a category
+        # is keyed on ANY in its place, so find_allocation_matches() also looks up the ANY key
+        allocation_marker_index = {}
+        for allocation_index, allocation_marker in enumerate(allocation_markers):
+            key = (
+                normalize(allocation_marker["flow_name"]),
+                ANY if allocation_marker["category"] is None else normalize(allocation_marker["category"]),
+            )
+            allocation_marker_index.setdefault(key, []).append(allocation_index)
+        return allocation_marker_index
 
-        # Flow name
-        if flow_name.strip() == allocation_marker["flow_name"].strip():
-            flow_match = True
-        
-        # Category
-        if allocation_marker["category"] is None:
-            category_match = True
-        elif isinstance(flow_category, str) and flow_category.strip() == allocation_marker["category"].strip():
-            category_match = True
-                
-        return flow_match and category_match
+    @staticmethod
+    def find_allocation_matches(allocation_marker_index: dict, flow_name: str, flow_category: str) -> list:
+        flow_key = normalize(flow_name)
+        category_key = normalize(flow_category)
+        allocation_indices = []
+        for key in [(flow_key, category_key), (flow_key, ANY)]:
+            allocation_indices.extend(allocation_marker_index.get(key, []))
+        return sorted(allocation_indices)
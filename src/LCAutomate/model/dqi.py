@@ -1,4 +1,6 @@
+import functools
 import math
+import numpy
 import pandas
 from src.LCAutomate.common_simplified import ReplicationColumnNames, ReplicationTabNames
 from src.LCAutomate.common_simplified import DQISubColumnNames
@@ -11,73 +13,93 @@ DQ = DQISubColumnNames
 
 class DQI:
 
+    # The parsed DQIs of a reformatted DQIs sheet are kept next to it (ExcelFile.parsed_dqis), not in DataFrame.attrs
+    # which pandas copies into every derived Series and DataFrame; by DQI column name, a tuple of:
+    #   - int8 array of shape (rows, 5) with the pedigree codes 1-5, 0 where a code is not 1-5
+    #   - float64 array of shape (rows,) with the base uncertainties, NaN where the row has no DQIs
+
     @staticmethod
-    def reformat_dqis_sheet_df(dqis_sheet_df: pandas.DataFrame) -> pandas.DataFrame:
-        reformatted_dqis_sheet_df = pandas.DataFrame()
-        column_index = 0
-        column_name_list = dqis_sheet_df.columns.to_list()
-        while column_index < len(column_name_list):
-            if column_index < len(RC.list()):
-                column_name = column_name_list[column_index]
-                column = dqis_sheet_df.iloc[:, column_index]
-                reformatted_dqis_sheet_df[column_name] = column[1:]
-                column_index += 1
-            else:
-                column_name = column_name_list[column_index]
-
-                # Get a block of 6 columns
-                dqi_column_block = {}
-                dqi_sub_headers = []
-                for j in range(6):
-                    column = dqis_sheet_df.iloc[:, column_index]
-                    dqi_sub_header = column.to_list()[0]
-                    dqi_column_block[dqi_sub_header] = column.to_list()[1:]
-                    dqi_sub_headers.append(dqi_sub_header)
-                    column_index += 1
-                if dqi_sub_headers != DQISubColumnNames.list():
-                    print(f"\nERROR: DQI sub-headers '{dqi_sub_headers}' must match '{DQISubColumnNames.list()}'", flush=True)
-                    return None
-                
-                # Squash the DQI sub-column values into a single string for each row
-                """
-                DQISubColumnNames.RELIABILITY,
-                DQISubColumnNames.COMPLETENESS,
-                DQISubColumnNames.TEMPORAL_CORRELATION,
-                DQISubColumnNames.GEOGRAPHICAL_CORRELATION,
-                DQISubColumnNames.FURTHER_TECHNOLOGICAL_CORRELATION,
-                DQISubColumnNames.BASE_UNCERTAINTY
-                """
-                squashed_column = []
-                column_length = len(dqi_column_block[DQISubColumnNames.RELIABILITY])
-                for j in range(column_length):
-                    base_uncertainty = dqi_column_block[DQISubColumnNames.BASE_UNCERTAINTY][j]
-                    try:
-                        float_value = float(base_uncertainty)
-                        if math.isnan(float_value) == True:
-                            base_uncertainty = None
-                        else:
-                            pass
-                    except:
-                        base_uncertainty = None
-
-                    if base_uncertainty is not None:
-                        squashed_str = (
-                            f"("
-                            f"{dqi_column_block[DQISubColumnNames.RELIABILITY][j]};"
-                            f"{dqi_column_block[DQISubColumnNames.COMPLETENESS][j]};"
-                            f"{dqi_column_block[DQISubColumnNames.TEMPORAL_CORRELATION][j]};"
-                            f"{dqi_column_block[DQISubColumnNames.GEOGRAPHICAL_CORRELATION][j]};"
-                            f"{dqi_column_block[DQISubColumnNames.FURTHER_TECHNOLOGICAL_CORRELATION][j]}"
-                            f")|"
-                            f"{dqi_column_block[DQISubColumnNames.BASE_UNCERTAINTY][j]}"
-                        )
-                    else:
-                        squashed_str = math.nan
-                    squashed_column.append(squashed_str)
-                reformatted_dqis_sheet_df[column_name] = squashed_column
-
-        return reformatted_dqis_sheet_df.reset_index()
+    def reformat_dqis_sheet_df(dqis_sheet_df: pandas.DataFrame, parsed_dqis: dict = None) -> pandas.DataFrame:
+        # parsed_dqis, if given, is filled with the parsed DQIs of each DQI column
+        # The key columns are followed by blocks of 6 DQI sub-columns; the first row holds the sub-headers
+        key_column_count = min(len(RC.list()), dqis_sheet_df.columns.size)
+        key_columns_df = dqis_sheet_df.iloc[1:, :key_column_count]
+
+        dqi_column_name_list = dqis_sheet_df.columns.to_list()[key_column_count:]
+        block_count = len(dqi_column_name_list) // 6
+        if block_count * 6 != len(dqi_column_name_list):
+            print(f"\nERROR: DQI columns must come in blocks of 6 sub-columns '{DQISubColumnNames.list()}'", flush=True)
+            return None
+
+        if dqis_sheet_df.index.size == 0:
+            print("\nERROR: DQI sub-headers must be given in the first row", flush=True)
+            return None
+
+        # Shape (rows + 1, blocks, 6 sub-columns)
+        values = dqis_sheet_df.iloc[:, key_column_count:].to_numpy(dtype=object).reshape(
+            dqis_sheet_df.index.size, block_count, 6
+        )
+        for dqi_sub_headers in values[0].tolist():
+            if dqi_sub_headers != DQISubColumnNames.list():
+                print(f"\nERROR: DQI sub-headers '{dqi_sub_headers}' must match '{DQISubColumnNames.list()}'", flush=True)
+                return None
+        values = values[1:]
+
+        # Squash the DQI sub-column values into a single string "(r;c;t;g;f)|u" for each row, NaN for a row without a
+        # numeric base uncertainty
+        base_uncertainties = pandas.to_numeric(
+            pandas.Series(values[:, :, 5].ravel(), dtype=object), errors="coerce"
+        ).to_numpy(dtype=numpy.float64).reshape(values.shape[:2])
+        has_dqis = ~numpy.isnan(base_uncertainties)
+
+        value_strings = values.astype(str)
+        squashed = value_strings[:, :, 0]
+        for j in range(1, 5):
+            squashed = numpy.char.add(numpy.char.add(squashed, ";"), value_strings[:, :, j])
+        squashed = numpy.char.add(numpy.char.add(numpy.char.add("(", squashed), ")|"), value_strings[:, :, 5])
+        squashed = squashed.astype(object)
+        squashed[~has_dqis] = math.nan
+
+        # Pedigree codes as compact integers, matched on the same strings as PedigreeMatrix.table
+        dqi_codes = numpy.zeros(value_strings.shape[:2] + (5,), dtype=numpy.int8)
+        for code in range(1, 6):
+            dqi_codes[value_strings[:, :, :5] == str(code)] = code
+        dqi_codes[~has_dqis] = 0
+
+        dqi_columns = {}
+        for block_index in range(block_count):
+            column_name = dqi_column_name_list[block_index * 6]
+            dqi_columns[column_name] = squashed[:, block_index].tolist()
+            if parsed_dqis is not None:
+                parsed_dqis[column_name] = (dqi_codes[:, block_index].copy(), base_uncertainties[:, block_index].copy())
+
+        reformatted_dqis_sheet_df = pandas.concat(
+            [key_columns_df, pandas.DataFrame(dqi_columns, index=key_columns_df.index)], axis=1
+        ).reset_index()
+        return reformatted_dqis_sheet_df
     
+    @staticmethod
+    def get_parsed_dqis(replication_file, data_column_name: str) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # Pedigree codes and base uncertainties of a DQI column of a replication file (ExcelFile)
+        parsed_dqis = getattr(replication_file, "parsed_dqis", None) or {}
+        if data_column_name in parsed_dqis:
+            return parsed_dqis[data_column_name]
+
+        # A sheet reformatted before the parsed DQIs were kept, e.g. in the state of a previous run
+        dqi_strings = replication_file.sheets[RT.DQIS][data_column_name].to_list()
+        dqi_codes = numpy.zeros((len(dqi_strings), 5), dtype=numpy.int8)
+        base_uncertainties = numpy.full(len(dqi_strings), numpy.nan)
+        for i, dqi_string in enumerate(dqi_strings):
+            if not isinstance(dqi_string, str):
+                continue
+            try:
+                dq_entry, base_uncertainty = DQI.parse(dqi_string)
+            except:
+                continue
+            dqi_codes[i] = [PedigreeMatrix.codes.get(dq_indicator, 0) for dq_indicator in (dq_entry[1:-1].split(";") + [""] * 5)[:5]]
+            base_uncertainties[i] = base_uncertainty
+        return dqi_codes, base_uncertainties
+
     @staticmethod
     def parse(dqi_string: str) -> tuple[str, float]:
         tokens = dqi_string.split("|")
@@ -126,26 +148,41 @@ class PedigreeMatrix:
         },
     }
 
+    codes = {str(code): code for code in range(1, 6)}
+
     @staticmethod
     def openlca_sigma_g(dq_entry: str, base_uncertainty: float) -> float:
-        dq_values = PedigreeMatrix.get_dq_values(dq_entry)
-        sum = 0.0
-        for dq_value in dq_values:
-            ln_dq_value = math.log(dq_value)
-            sum += ln_dq_value * ln_dq_value
+        dq_indicators = dq_entry[1:-1].split(";")[:5]
+        if len(dq_indicators) != 5 or any(dq_indicator not in PedigreeMatrix.codes for dq_indicator in dq_indicators):
+            raise ValueError(f"Invalid DQ entry '{dq_entry}'")
+        sum = PedigreeMatrix.get_summed_squared_logs()[tuple(PedigreeMatrix.codes[dq_indicator] - 1 for dq_indicator in dq_indicators)]
 
         ln_Ub = math.log(base_uncertainty)
         
         return math.exp(math.sqrt(ln_Ub * ln_Ub + sum))
-        
+
     @staticmethod
-    def get_dq_values(dq_entry: str) -> list[float]:
-        dq_indicators = dq_entry[1:-1].split(";")
-        dq_values = []
-        dq_values.append(PedigreeMatrix.table[DQ.RELIABILITY][dq_indicators[0]])
-        dq_values.append(PedigreeMatrix.table[DQ.COMPLETENESS][dq_indicators[1]])
-        dq_values.append(PedigreeMatrix.table[DQ.TEMPORAL_CORRELATION][dq_indicators[2]])
-        dq_values.append(PedigreeMatrix.table[DQ.GEOGRAPHICAL_CORRELATION][dq_indicators[3]])
-        dq_values.append(PedigreeMatrix.table[DQ.FURTHER_TECHNOLOGICAL_CORRELATION][dq_indicators[4]])
-
-        return dq_values
+    def sigma_g_many(dq_codes_array: numpy.ndarray, base_uncertainties_array: numpy.ndarray) -> numpy.ndarray:
+        # Geometric standard deviations for arrays of pedigree codes (..., 5) and base uncertainties (...)
+        #   - NaN where a code is not 1-5 or the base uncertainty is missing, infinite for a base uncertainty of 0
+        dq_codes_array = numpy.asarray(dq_codes_array, dtype=numpy.intp)
+        base_uncertainties_array = numpy.asarray(base_uncertainties_array, dtype=numpy.float64)
+        valid = numpy.all((dq_codes_array >= 1) & (dq_codes_array <= 5), axis=-1)
+        indices = numpy.where(valid[..., numpy.newaxis], dq_codes_array - 1, 0)
+        sum = PedigreeMatrix.get_summed_squared_logs()[tuple(numpy.moveaxis(indices, -1, 0))]
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            ln_Ub = numpy.log(base_uncertainties_array)
+            sigma_g = numpy.exp(numpy.sqrt(ln_Ub * ln_Ub + sum))
+        return numpy.where(valid, sigma_g, numpy.nan)
+
+    @classmethod
+    @functools.cache
+    def get_summed_squared_logs(cls) -> numpy.ndarray:
+        # Sum of the squared logs of the pedigree factors for each of the 5^5 combinations of codes, indexed by the codes
+        # minus 1; computed once on first use, summed in the order of the DQI sub-columns as in the per-entry computation
+        squared_logs = []
+        for dq in DQ.list()[:5]:
+            ln_dq_values = numpy.log([cls.table[dq][str(code)] for code in range(1, 6)])
+            squared_logs.append(ln_dq_values * ln_dq_values)
+        return functools.reduce(numpy.add.outer, squared_logs)
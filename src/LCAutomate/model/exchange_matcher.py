@@ -1,8 +1,10 @@
 import pandas
+from collections import Counter
 from src.olca__patched import ipc as olca
 from src.olca__patched import schema as olca_schema
 
 from src.LCAutomate.common_simplified import ReplicationColumnNames
+from src.LCAutomate.model.marker_index import ANY, normalize
 
 
 RC = ReplicationColumnNames
@@ -22,25 +24,22 @@ class ExchangeMatcher:
         if exchange_markers is None:
             return None
 
+        # Hash join of the Amounts rows on the exchange markers, see get_exchange_marker_index
+        exchange_marker_index = ExchangeMatcher.get_exchange_marker_index(exchange_markers)
         matched_exchange_index_list = []
 
-        for i in range(amounts_sheet_df.index.size):
-            flow_name = amounts_sheet_df[RC.FLOW][i]
-            description = amounts_sheet_df[RC.DESCRIPTION][i]
-            category = amounts_sheet_df[RC.CATEGORY][i]
-
+        flow_names = amounts_sheet_df[RC.FLOW].tolist()
+        descriptions = amounts_sheet_df[RC.DESCRIPTION].tolist()
+        categories = amounts_sheet_df[RC.CATEGORY].tolist()
+        for flow_name, description, category in zip(flow_names, descriptions, categories):
             # Find test matching exchange(s)
-            test_exchange_matches = []
-            test_exchange_match_indices = []
-            for exchange_index, exchange_marker in enumerate(exchange_markers):
-                match = ExchangeMatcher.is_exchange_match(exchange_marker, flow_name, description, category)
-                if match:
-                    test_exchange_matches.append(exchange_marker)
-                    test_exchange_match_indices.append(exchange_index)
-            if len(test_exchange_matches) != 1:
-                print(f"ERROR: Found {len(test_exchange_matches)} Exchange matches for '{openlca_process.name}': "
+            test_exchange_match_indices = ExchangeMatcher.find_exchange_matches(
+                exchange_marker_index, flow_name, description, category
+            )
+            if len(test_exchange_match_indices) != 1:
+                print(f"ERROR: Found {len(test_exchange_match_indices)} Exchange matches for '{openlca_process.name}': "
                       f"flow='{flow_name}', description='{description}', category='{category}'")
-                if len(test_exchange_matches) > 1:
+                if len(test_exchange_match_indices) > 1:
                     print("  - multiple Exchange matches must be distinguished with different descriptions")
                     print("  - sample Exchange shown below:")
                     print(f"\n{openlca_process.exchanges[test_exchange_match_indices[0]]}")
@@ -57,10 +56,13 @@ class ExchangeMatcher:
         flow_names = []
         descriptions = []
         categories = []
-        for exchange in exchanges:
+        flows = client.get_many(olca_schema.Flow, [exchange.flow.id for exchange in exchanges], cached=True)
+        for exchange, (flow, err) in zip(exchanges, flows):
+            if flow is None:
+                print(f"ERROR: Flow '{exchange.flow.name}' ({exchange.flow.id}) of '{openlca_process.name}' is not found in OpenLCA DB: {err}")
+                return None
             flow_names.append(exchange.flow.name)
             descriptions.append(exchange.description)
-            flow = client.get(olca_schema.Flow, exchange.flow.id)
             category_ref = flow.category
             if category_ref is None:
                 category = ""
@@ -69,28 +71,22 @@ class ExchangeMatcher:
             category_path = "/".join(category)
             categories.append(category_path)
 
+        # An exchange is marked by its flow name, plus its description if the flow name is not unique, plus its category
+        # if the flow name and description are not unique
+        flow_name_counts = Counter(flow_names)
+        flow_name_description_counts = Counter(zip(flow_names, descriptions))
+        flow_name_description_category_counts = Counter(zip(flow_names, descriptions, categories))
+
         exchange_markers = []
         for i, flow_name in enumerate(flow_names):
             description = None
             category_path = None
 
-            duplicate = False
-            for j in range(len(flow_names)):
-                if i != j and flow_name == flow_names[j]:
-                    duplicate = True
-            if duplicate:
-                duplicate = False
+            if flow_name_counts[flow_name] > 1:
                 description = descriptions[i]
-                for j in range(len(flow_names)):
-                    if i != j and flow_name == flow_names[j] and description == descriptions[j]:
-                        duplicate = True
-                if duplicate:
-                    duplicate = False
+                if flow_name_description_counts[(flow_name, description)] > 1:
                     category_path = categories[i]
-                    for j in range(len(flow_names)):
-                        if i != j and flow_name == flow_names[j] and description == descriptions[j] and category_path == categories[j]:
-                            duplicate = True
-                    if duplicate:
+                    if flow_name_description_category_counts[(flow_name, description, category_path)] > 1:
                         print(f"ERROR: The combination\n"
                               f"  - Flow: '{flow_name}'\n"
                               f"  - Description '{description}'\n"
@@ -100,7 +96,7 @@ class ExchangeMatcher:
                         return None
                     
             exchange_markers.append({
-                "internal_id": exchange.internal_id,
+                "internal_id": exchanges[i].internal_id,
                 "flow_name": flow_name,
                 "description": description,
                 "category": category_path,
@@ -109,26 +105,30 @@ class ExchangeMatcher:
         return exchange_markers
 
     @staticmethod
-    def is_exchange_match(exchange_marker: dict, flow_name: str, description: str, flow_category: str) -> bool:
-        # TODO: Provide detailed information on misses - is this still necessary?
-        flow_match = False
-        description_match = False
-        category_match = False
+    def get_exchange_marker_index(exchange_markers: list) -> dict:
+        # Index of the exchange indices by (flow name, description, category) on stripped values; a marker without a
+        # description or category is keyed on ANY in its place, so find_exchange_matches() also looks up the ANY keys
+        exchange_marker_index = {}
+        for exchange_index, exchange_marker in enumerate(exchange_markers):
+            key = (
+                normalize(exchange_marker["flow_name"]),
+                ANY if exchange_marker["description"] is None else normalize(exchange_marker["description"]),
+                ANY if exchange_marker["category"] is None else normalize(exchange_marker["category"]),
+            )
+            exchange_marker_index.setdefault(key, []).append(exchange_index)
+        return exchange_marker_index
 
-        # Flow name
-        if flow_name.strip() == exchange_marker["flow_name"].strip():
-            flow_match = True
-        
-        # Description
-        if exchange_marker["description"] is None:
-            description_match = True
-        elif isinstance(description, str) and description.strip() == exchange_marker["description"].strip():
-            description_match = True
-         
-        # Category
-        if exchange_marker["category"] is None:
-            category_match = True
-        elif isinstance(flow_category, str) and flow_category.strip() == exchange_marker["category"].strip():
-            category_match = True
-                
-        return flow_match and description_match and category_match
+    @staticmethod
+    def find_exchange_matches(exchange_marker_index: dict, flow_name: str, description: str, flow_category: str) -> list:
+        flow_key = normalize(flow_name)
+        description_key = normalize(description)
+        category_key = normalize(flow_category)
+        exchange_indices = []
+        for key in [
+            (flow_key, description_key, category_key),
+            (flow_key, description_key, ANY),
+            (flow_key, ANY, category_key),
+            (flow_key, ANY, ANY),
+        ]:
+            exchange_indices.extend(exchange_marker_index.get(key, []))
+        return sorted(exchange_indices)
@@ -0,0 +1,11 @@
+# Shared by the exchange and allocation marker indices
+
+# Wildcard key part: a marker without a description or category matches any description or category
+ANY = object()
+
+
+def normalize(value) -> str:
+    # Only strings match; missing cells (NaN) and other values never equal a marker key
+    if isinstance(value, str):
+        return value.strip()
+    return None
@@ -2,18 +2,23 @@ import json
 import math
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import pandas
 
 from src.LCAutomate.model.allocation_matcher import AllocationMatcher
 from src.LCAutomate.model.dqi import DQI
 from src.LCAutomate.model.exchange_matcher import ExchangeMatcher
-from src.LCAutomate.state import State
+from src.LCAutomate.model.replicant_hash import INPUT_HASH, ReplicantHash
+from src.LCAutomate.state import create_state
 from src.olca__patched import ipc as olca
 from src.olca__patched import schema as olca_schema
 from src.LCAutomate.excel_file import ExcelFile
+from src.LCAutomate.object_store import ObjectStore
 from src.LCAutomate.model.template_process import TemplateProcess, TemplateProcessEncoder, TemplateProcessShortEncoder
 
-from src.LCAutomate.common_simplified import DRIVER_FILENAME, DriverColumnNames, DriverTabNames
+from src.LCAutomate.common_simplified import DRIVER_FILENAME, STATE_BACKEND_PICKLE, DriverColumnNames, DriverTabNames
 from src.LCAutomate.common_simplified import INPUT, OUTPUT
 from src.LCAutomate.common_simplified import ReplicationColumnNames, ReplicationTabNames
 
@@ -24,8 +29,46 @@ RC = ReplicationColumnNames
 RT = ReplicationTabNames
 
 
+def load_replication_file(replication_filepath: str, driver_df_index: int) -> tuple:
+    # Load and validate one replication file, including the DQIs reformatting
+    #   - runs in a worker process of Model.load_replication_files, so it is a top-level function
+    #   - returns the loaded ExcelFile (None on error) and the messages to print for it, in order
+    messages = []
+    replication_excel_file = ExcelFile(replication_filepath, RC.list())
+    loaded = replication_excel_file.load()
+    if not loaded:
+        messages.append(f"\nERROR: Replication file '{replication_filepath}' in row {driver_df_index + 2} cannot be loaded")
+        for validation_error in replication_excel_file.validation_errors:
+            messages.append(f"  - {validation_error}")
+        return None, messages
+
+    if RT.AMOUNTS not in replication_excel_file.sheets.keys():
+        messages.append(f"\nERROR: Sheet name '{RT.AMOUNTS}' must be in replication file '{replication_filepath}'")
+        return None, messages
+
+    messages.append(f"  - Valid replication file: {replication_filepath}")
+    messages.append(f"    - contains sheets: {list(replication_excel_file.sheets.keys())}")
+    unrecognized_sheets = []
+    for sheet_name in replication_excel_file.sheets.keys():
+        if sheet_name not in RT.list():
+            unrecognized_sheets.append(sheet_name)
+    if len(unrecognized_sheets) > 0:
+        messages.append(f"    - note that these sheets are unrecognized and will be ignored: {unrecognized_sheets}")
+
+    if RT.DQIS in replication_excel_file.sheets.keys():
+        reformatted_dqis_sheet_df = DQI.reformat_dqis_sheet_df(
+            replication_excel_file.sheets[RT.DQIS], replication_excel_file.parsed_dqis
+        )
+        if reformatted_dqis_sheet_df is None:
+            messages.append(f"\nERROR: Incorrect formatting of '{RT.DQIS}' sheet in '{replication_filepath}'")
+            return None, messages
+        replication_excel_file.sheets[RT.DQIS] = reformatted_dqis_sheet_df
+
+    return replication_excel_file, messages
+
+
 class Model:
-    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool):
+    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool, state_backend: str = STATE_BACKEND_PICKLE):
         self.client = client
         self.base_root_folder = input_root_folder
         self.restart = restart
@@ -33,7 +76,10 @@ class Model:
         self.driver_df = None
         self.top_level_process_uuid = None
         self.template_processes = {}
-        self.state = State(self.base_root_folder)
+        self.prefetched_processes = {}
+        self.state = create_state(self.base_root_folder, state_backend)
+        # The OpenLCA processes and replication sheets are kept out of the state, see TemplateProcess.__getstate__
+        self.object_store = ObjectStore(self.base_root_folder)
 
     def do(self) -> bool:
         if self.restart:
@@ -43,7 +89,9 @@ class Model:
         if not model_built:
             print("\n*** Correct the errors indicated above before proceeding ***", flush=True)
             return False
-        
+
+        self.carry_over_replicants()
+
         state_saved = self.save_state()
         if state_saved:
             print(f"\nSaved model to {self.state.filepath}")
@@ -84,12 +132,18 @@ class Model:
 
         # Load template processes
         print(f"\nLoading template processes...", flush=True)
+        loaded_replication_files = self.load_replication_files()
+        template_processes_loaded = True
         for i in range(self.driver_df.index.size):
-            template_process = self.get_template_process(i)
+            template_process = self.get_template_process(i, loaded_replication_files[i])
             if template_process is None:
-                return False
+                template_processes_loaded = False
+                continue
             
             self.template_processes[template_process.uuid] = template_process
+        if not template_processes_loaded:
+            return False
+        self.prefetch_flows()
 
         # Check that all data suffixes match - use top-level process as standard
         standard_data_columns = self.template_processes[self.top_level_process_uuid].replicants.keys()
@@ -120,6 +174,7 @@ class Model:
 
         print(f"\nBuilding process hierarchy model...", flush=True)
         hierarchy_built = self.recursively_build_hierarchy(self.template_processes[self.top_level_process_uuid], ancestry="root")
+        print(f"\nFlow cache: {self.client.entity_cache}", flush=True)
         if not hierarchy_built:
             return False
         
@@ -130,44 +185,42 @@ class Model:
 
         return True
     
-    def get_template_process(self, driver_df_index: int) -> TemplateProcess:
+    def load_replication_files(self) -> list:
+        # The replication files are parsed and validated in a process pool while the template processes are fetched from
+        # OpenLCA concurrently; the results are returned in driver-row order
+        replication_filepaths = [
+            os.path.join(self.base_root_folder, self.driver_df[DC.REPLICATION_FILE][i]) for i in range(self.driver_df.index.size)
+        ]
+        if len(replication_filepaths) <= 1:
+            self.prefetch_template_processes()
+            return [load_replication_file(filepath, i) for i, filepath in enumerate(replication_filepaths)]
+
+        try:
+            with ProcessPoolExecutor(max_workers=min(len(replication_filepaths), os.cpu_count() or 1)) as executor:
+                futures = [executor.submit(load_replication_file, filepath, i) for i, filepath in enumerate(replication_filepaths)]
+                self.prefetch_template_processes()
+                return [future.result() for future in futures]
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Could not load the replication files in parallel ({e}), loading them one by one", flush=True)
+            return [load_replication_file(filepath, i) for i, filepath in enumerate(replication_filepaths)]
+
+    def get_template_process(self, driver_df_index: int, loaded_replication_file: tuple) -> TemplateProcess:
         process_name = self.driver_df[DC.TEMPLATE_PROCESS_NAME][driver_df_index]
         print(f"\n  {process_name}")
 
-        # Validate replication file
-        filename = self.driver_df[DC.REPLICATION_FILE][driver_df_index]
-        replication_filepath = os.path.join(self.base_root_folder, filename)
-        replication_excel_file = ExcelFile(replication_filepath, RC.list())
-        loaded = replication_excel_file.load()
-        if not loaded:
-            print(f"\nERROR: Replication file '{replication_filepath}' in row {driver_df_index + 2} cannot be loaded", flush=True)
-            for validation_error in replication_excel_file.validation_errors:
-                print(f"  - {validation_error}")
+        # Validated replication file, see load_replication_file
+        replication_excel_file, messages = loaded_replication_file
+        for message in messages:
+            print(message, flush=True)
+        if replication_excel_file is None:
             return None
 
-        if RT.AMOUNTS not in replication_excel_file.sheets.keys():
-            print(f"\nERROR: Sheet name '{RT.AMOUNTS}' must be in replication file '{replication_filepath}'", flush=True)
-            return None
-
-        print(f"  - Valid replication file: {replication_filepath}")
-        print(f"    - contains sheets: {list(replication_excel_file.sheets.keys())}")
-        unrecognized_sheets = []
-        for sheet_name in replication_excel_file.sheets.keys():
-            if sheet_name not in RT.list():
-                unrecognized_sheets.append(sheet_name)
-        if len(unrecognized_sheets) > 0:
-            print(f"    - note that these sheets are unrecognized and will be ignored: {unrecognized_sheets}")
-
-        if RT.DQIS in replication_excel_file.sheets.keys():
-            reformatted_dqis_sheet_df = DQI.reformat_dqis_sheet_df(replication_excel_file.sheets[RT.DQIS])
-            if reformatted_dqis_sheet_df is None:
-                print(f"\nERROR: Incorrect formatting of '{RT.DQIS}' sheet in '{replication_filepath}'", flush=True)
-                return None
-            replication_excel_file.sheets[RT.DQIS] = reformatted_dqis_sheet_df
-        
         # Get process from OpenLCA DB
         uuid = self.driver_df[DC.TEMPLATE_PROCESS_UUID][driver_df_index]
-        openlca_process = self.client.get(olca_schema.Process, uuid)
+        if uuid in self.prefetched_processes:
+            openlca_process = self.prefetched_processes[uuid]
+        else:
+            openlca_process = self.client.get(olca_schema.Process, uuid)
         if openlca_process is not None:
             print(f"  - Valid process: {openlca_process.name} ({uuid})")
         else:
@@ -176,13 +229,33 @@ class Model:
         
         replication_base_name = self.driver_df[DC.REPLICATION_BASE_NAME][driver_df_index]
 
-        template_process = TemplateProcess(openlca_process, replication_base_name, replication_excel_file)
+        template_process = TemplateProcess(openlca_process, replication_base_name, replication_excel_file, self.object_store)
         for column in replication_excel_file.sheets[RT.AMOUNTS]:
             if column not in RC.list():
                 template_process.replicants[column] = None
 
         return template_process
             
+    def prefetch_template_processes(self):
+        # Fetch all template processes from OpenLCA in one concurrent batch
+        uuids = [uuid for uuid in self.driver_df[DC.TEMPLATE_PROCESS_UUID] if isinstance(uuid, str)]
+        for uuid, (openlca_process, err) in zip(uuids, self.client.get_many(olca_schema.Process, uuids)):
+            if err is None:
+                self.prefetched_processes[uuid] = openlca_process
+
+    def prefetch_flows(self):
+        # Warm the client's entity cache with every flow the matchers will look up
+        flow_ids = set()
+        for template_process in self.template_processes.values():
+            for exchange in template_process.openlca_process.exchanges or []:
+                flow_ids.add(exchange.flow.id)
+            for allocation_factor in template_process.openlca_process.allocation_factors or []:
+                if allocation_factor.allocation_type == olca_schema.AllocationType.PHYSICAL:
+                    flow_ids.add(allocation_factor.product.id)
+        # The prefetched flows must not be evicted before the matchers use them
+        self.client.entity_cache.reserve(len(self.client.entity_cache) + len(flow_ids))
+        self.client.get_many(olca_schema.Flow, sorted(flow_ids), cached=True)
+
     def recursively_build_hierarchy(self, template_process: TemplateProcess, ancestry: str) -> bool:
         print(f"{ancestry} -> {template_process.name}")
         template_process.is_referenced = True
@@ -212,8 +285,9 @@ class Model:
                             return False
                         
         # Match allocations returned from OpenLCA with Physical Allocations sheet (if it exists)
+        #   - once per template process, which is visited again for each parent referencing it
         allocations_sheet_df = template_process.replication_file.sheets.get(RT.PHYSICAL_ALLOCATIONS, None)
-        if allocations_sheet_df is not None:
+        if allocations_sheet_df is not None and template_process.matched_allocation_index_list is None:
             matched_allocation_index_list = AllocationMatcher.get_matched_allocation_index_list(
                 self.client, openlca_process, allocations_sheet_df
             )
@@ -223,6 +297,32 @@ class Model:
  
         return True
     
+    def carry_over_replicants(self):
+        # Stamp each replicant with the hash of its inputs and keep the previously built replicants (processes, product
+        # systems and calculation files) whose inputs did not change; the others are rebuilt by the following steps
+        input_hashes = ReplicantHash.get_input_hashes(self.template_processes[self.top_level_process_uuid])
+        previous_state = self.state.load()
+        previous_template_processes = previous_state["template_processes"] if previous_state is not None else {}
+
+        carried_over_count = 0
+        replicant_count = 0
+        for uuid, template_process in self.template_processes.items():
+            previous_template_process = previous_template_processes.get(uuid, None)
+            for data_column_name in template_process.replicants.keys():
+                replicant_count += 1
+                input_hash = input_hashes[uuid][data_column_name]
+                previous_replicant = None
+                if previous_template_process is not None:
+                    previous_replicant = previous_template_process.replicants.get(data_column_name, None)
+                if previous_replicant is not None and previous_replicant.get(INPUT_HASH, None) == input_hash:
+                    template_process.replicants[data_column_name] = previous_replicant
+                    carried_over_count += 1
+                else:
+                    template_process.replicants[data_column_name] = {INPUT_HASH: input_hash}
+
+        print(f"\n{carried_over_count} of {replicant_count} replicant(s) unchanged since the previous model, "
+              f"{replicant_count - carried_over_count} to be rebuilt", flush=True)
+
     def reset(self):
         self.state.delete()
 
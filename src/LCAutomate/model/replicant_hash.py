@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+from src.LCAutomate.model.template_process import TemplateProcess
+
+from src.LCAutomate.common_simplified import ReplicationColumnNames, ReplicationTabNames
+
+
+RC = ReplicationColumnNames
+RT = ReplicationTabNames
+
+# Key in the replicant records of the state
+INPUT_HASH = "input_hash"
+
+
+class ReplicantHash:
+    # A replicant's input hash covers everything that its process (and therefore its product system and calculation
+    # results) is built from:
+    #   - the template process: UUID, last change in OpenLCA and replication base name
+    #   - the key columns of the Amounts, Physical Allocations and DQIs sheets and the matched exchanges/allocations
+    #   - the replicant's data column in these sheets
+    #   - the input hashes of the child replicants of the same data column
+
+    @staticmethod
+    def get_input_hashes(template_process: TemplateProcess, input_hashes: dict = None) -> dict:
+        # Returns {template process uuid: {data column name: input hash}} for the template process and its descendants
+        if input_hashes is None:
+            input_hashes = {}
+        if template_process.uuid in input_hashes:
+            return input_hashes
+
+        for child_process in template_process.child_processes:
+            ReplicantHash.get_input_hashes(child_process, input_hashes)
+
+        template_hash = ReplicantHash.get_template_hash(template_process)
+        sheets = template_process.replication_file.sheets
+        process_hashes = {}
+        for data_column_name in template_process.replicants.keys():
+            sha = hashlib.sha256(template_hash.encode())
+            for sheet_name in RT.list():
+                sheet_df = sheets.get(sheet_name, None)
+                if sheet_df is not None and data_column_name in sheet_df:
+                    sha.update(ReplicantHash.get_values_json(sheet_df[data_column_name]).encode())
+            for child_process in template_process.child_processes:
+                sha.update(input_hashes[child_process.uuid][data_column_name].encode())
+            process_hashes[data_column_name] = sha.hexdigest()
+
+        input_hashes[template_process.uuid] = process_hashes
+        return input_hashes
+
+    @staticmethod
+    def get_template_hash(template_process: TemplateProcess) -> str:
+        sha = hashlib.sha256()
+        sha.update(json.dumps([
+            template_process.uuid,
+            template_process.openlca_process.last_change,
+            template_process.replication_base_name,
+            template_process.matched_exchange_index_list,
+            template_process.matched_allocation_index_list,
+        ], default=str).encode())
+        for sheet_name in RT.list():
+            sheet_df = template_process.replication_file.sheets.get(sheet_name, None)
+            if sheet_df is None:
+                continue
+            sha.update(sheet_name.encode())
+            for column_name in RC.list():
+                if column_name in sheet_df:
+                    sha.update(column_name.encode())
+                    sha.update(ReplicantHash.get_values_json(sheet_df[column_name]).encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def get_values_json(column) -> str:
+        return json.dumps(column.tolist(), default=str)
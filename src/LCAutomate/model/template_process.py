@@ -4,6 +4,7 @@ import pandas
 import copy
 
 from src.LCAutomate.excel_file import ExcelFile
+from src.LCAutomate.object_store import ObjectStore
 from src.olca__patched import schema as olca_schema
 
 from src.LCAutomate.common_simplified import DRIVER_FILENAME, DriverColumnNames
@@ -20,7 +21,14 @@ class TemplateProcess:
             openlca_process: olca_schema.Process, 
             replication_base_name: str, 
             replication_file: ExcelFile,
+            object_store: ObjectStore = None,
             ):
+        # With an object store, the OpenLCA process and the replication sheets are not pickled with the state, see
+        # __getstate__
+        self.object_store = object_store
+        self.openlca_process_key = None
+        self.replication_sheets_key = None
+        self.parsed_dqis_key = None
         self.openlca_process = openlca_process
         self.name = openlca_process.name
         self.uuid = openlca_process.id
@@ -34,6 +42,69 @@ class TemplateProcess:
         self.replicants = {}
         self.product_systems = {}
 
+    @property
+    def openlca_process(self) -> olca_schema.Process:
+        if self._openlca_process is None and self.openlca_process_key is not None:
+            self._openlca_process = self.object_store.get(self.openlca_process_key)
+        return self._openlca_process
+
+    @openlca_process.setter
+    def openlca_process(self, openlca_process: olca_schema.Process):
+        self._openlca_process = openlca_process
+        self.openlca_process_key = None
+
+    @property
+    def replication_file(self) -> ExcelFile:
+        if self._replication_file.sheets is None and self.replication_sheets_key is not None:
+            self._replication_file.sheets = self.object_store.get(self.replication_sheets_key)
+        if getattr(self._replication_file, "parsed_dqis", None) is None and self.parsed_dqis_key is not None:
+            self._replication_file.parsed_dqis = self.object_store.get(self.parsed_dqis_key)
+        return self._replication_file
+
+    @replication_file.setter
+    def replication_file(self, replication_file: ExcelFile):
+        self._replication_file = replication_file
+        self.replication_sheets_key = None
+        self.parsed_dqis_key = None
+
+    def __getstate__(self):
+        # The slim state holds identifiers, matched index lists and replicant records; the OpenLCA process and the
+        # replication sheets with their parsed DQIs are written once to the object store and reloaded from there when
+        # they are accessed
+        state = self.__dict__.copy()
+        if self.object_store is None:
+            return state
+
+        if self._openlca_process is not None and self.openlca_process_key is None:
+            self.openlca_process_key = self.object_store.put(self._openlca_process)
+        if self._replication_file.sheets is not None and self.replication_sheets_key is None:
+            self.replication_sheets_key = self.object_store.put(self._replication_file.sheets)
+        parsed_dqis = getattr(self._replication_file, "parsed_dqis", None)
+        if parsed_dqis and self.parsed_dqis_key is None:
+            self.parsed_dqis_key = self.object_store.put(parsed_dqis)
+
+        replication_file = copy.copy(self._replication_file)
+        replication_file.sheets = None
+        if self.parsed_dqis_key is not None:
+            replication_file.parsed_dqis = None
+        state["_openlca_process"] = None
+        state["_replication_file"] = replication_file
+        state["openlca_process_key"] = self.openlca_process_key
+        state["replication_sheets_key"] = self.replication_sheets_key
+        state["parsed_dqis_key"] = self.parsed_dqis_key
+        return state
+
+    def __setstate__(self, state: dict):
+        # States saved before the object store was introduced hold the OpenLCA process and replication file directly
+        if "openlca_process" in state:
+            state["_openlca_process"] = state.pop("openlca_process")
+            state["_replication_file"] = state.pop("replication_file")
+        state.setdefault("object_store", None)
+        state.setdefault("openlca_process_key", None)
+        state.setdefault("replication_sheets_key", None)
+        state.setdefault("parsed_dqis_key", None)
+        self.__dict__.update(state)
+
     def clone_openlca_process(self) -> olca_schema.Process:
         clone = copy.deepcopy(self.openlca_process)
         clone.id = str(uuid.uuid4())
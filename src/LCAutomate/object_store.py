@@ -0,0 +1,70 @@
+import hashlib
+import os
+import pickle
+
+from src.LCAutomate.common_simplified import CACHE_FOLDER_NAME
+
+
+class ObjectStore:
+    # A content-addressed store of pickled objects in <input root folder>/__cache__/objects/<sha256>.pkl
+    #   - an object is written once and then referenced by its key, so the state only holds the keys
+    #   - an unchanged object gets the same key again, so it is not written twice
+    #   - the objects that the saved state no longer references are removed when it is saved, see prune_object_store()
+    def __init__(self, input_root_folder: str):
+        self.base_root_folder = input_root_folder
+        self.folder_path = os.path.join(self.base_root_folder, CACHE_FOLDER_NAME, "objects")
+
+    def put(self, obj) -> str:
+        data = pickle.dumps(obj)
+        key = hashlib.sha256(data).hexdigest()
+        filepath = self.get_filepath(key)
+        if not os.path.isfile(filepath):
+            os.makedirs(self.folder_path, exist_ok=True)
+            temp_filepath = f"{filepath}.{os.getpid()}.tmp"
+            with open(temp_filepath, "wb") as f:
+                f.write(data)
+            os.replace(temp_filepath, filepath)
+        return key
+
+    def get(self, key: str):
+        with open(self.get_filepath(key), "rb") as f:
+            return pickle.load(f)
+
+    def get_filepath(self, key: str) -> str:
+        return os.path.join(self.folder_path, f"{key}.pkl")
+
+    def prune(self, keys: set):
+        # Remove the objects that are not in keys; temporary files of objects being written are left alone
+        try:
+            filenames = os.listdir(self.folder_path)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            key, extension = os.path.splitext(filename)
+            if extension == ".pkl" and key not in keys:
+                try:
+                    os.unlink(os.path.join(self.folder_path, filename))
+                except OSError:
+                    pass
+
+
+def attach_object_store(template_processes: dict, input_root_folder: str):
+    # Point the loaded template processes to the object store of the input root folder, which may have been moved or
+    # given as a different relative path since the state was saved
+    object_store = ObjectStore(input_root_folder)
+    for template_process in template_processes.values():
+        if getattr(template_process, "object_store", None) is not None:
+            template_process.object_store = object_store
+
+
+def prune_object_store(template_processes: dict, input_root_folder: str):
+    # Remove the objects that the saved state no longer references, e.g. those of template processes that changed or
+    # were removed from the model since the previous run; called after the state was saved, when the keys are set
+    keys = set()
+    for template_process in template_processes.values():
+        for key in [getattr(template_process, "openlca_process_key", None),
+                    getattr(template_process, "replication_sheets_key", None),
+                    getattr(template_process, "parsed_dqis_key", None)]:
+            if key is not None:
+                keys.add(key)
+    ObjectStore(input_root_folder).prune(keys)
@@ -14,6 +14,7 @@ from src.LCAutomate.common import UnitsKeys
 from src.LCAutomate.common import OpenLCAUnitsKeys
 from src.LCAutomate.common import ConsolidatedFlowKeys
 from src.LCAutomate.common import INPUT, OUTPUT
+from src.LCAutomate.excel_writer import write_sheets
 
 from src.LCAutomate.process_hierarchy.general_information_validator import GeneralInformationValidator
 
@@ -36,42 +37,32 @@ class OpenLCAExcelAdapter:
             validation_errors.append(f"Not a file: {self.file_relpath}")
             return validation_errors
 
-        # Validate as Excel spreadsheet
-        validation_errors.extend(self._validate_as_excel())
+        # Validate as Excel spreadsheet, reading all sheets in a single pass
+        sheet_dfs, read_errors = self._read_excel()
+        validation_errors.extend(read_errors)
         if validation_errors:
             return validation_errors
 
         # Check sheet names
         for sheet_name in SheetNames.list():
-            sheet_df = self._get_sheet_df(sheet_name)
-            if sheet_df is None:
+            if sheet_name not in sheet_dfs:
                 validation_errors.append(f"Missing worksheet: {sheet_name}")
         if validation_errors:
             return validation_errors
 
-        # Store the sheets as dicts
-        df = pandas.ExcelFile(self.input_file_path, engine="openpyxl")
-        for sheet_name in df.sheet_names:
-            sheet_df = self._get_sheet_df(sheet_name)
-            sheet = sheet_df.to_dict()
-            self.sheets[sheet_name] = sheet
+        # Store the sheets column-oriented: {column name: [values in row order]}
+        for sheet_name, sheet_df in sheet_dfs.items():
+            self.sheets[sheet_name] = sheet_df.to_dict(orient="list")
 
         return validation_errors
 
-    def _validate_as_excel(self) -> list:
-        # Try to import file as Excel, ignore exception as indicating that file is not Excel
+    def _read_excel(self) -> tuple:
+        # Try to import file as Excel, treat an exception as indicating that file is not Excel
         try:
-            pandas.read_excel(self.input_file_path, engine="openpyxl")
-            return []
+            sheet_dfs = pandas.read_excel(self.input_file_path, sheet_name=None, engine="openpyxl")
+            return sheet_dfs, []
         except Exception as e:
-            return [f"Error on test read of Excel file: {e}"]
-
-    def _get_sheet_df(self, sheet_name: str) -> pandas.DataFrame:
-        try:
-            sheet_df = pandas.read_excel(self.input_file_path, sheet_name, engine="openpyxl")
-            return sheet_df
-        except Exception as e:
-            return None
+            return {}, [f"Error on test read of Excel file: {e}"]
 
     def get_general_information(self) -> dict:
         general_information = {}
@@ -294,9 +285,6 @@ class OpenLCAExcelAdapter:
             print(f"ERROR: {output_file_relpath} must be a simple filename or a single sub-folder plus a filename, stopping")
             return
 
-        with pandas.ExcelWriter(output_file_path) as writer:
-            for sheet_name in self.sheets:
-                sheet = self.sheets[sheet_name]
-                sheet_df = pandas.DataFrame.from_dict(sheet)
-                sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        # The column-oriented sheets are streamed row by row, without building DataFrames
+        write_sheets(output_file_path, self.sheets)
   
\ No newline at end of file
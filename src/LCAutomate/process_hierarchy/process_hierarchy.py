@@ -2,10 +2,10 @@ import json
 from src.LCAutomate.calculation.calculation import Calculation
 from src.LCAutomate.model.template_process import TemplateProcess, TemplateProcessEncoder, TemplateProcessShortEncoder
 from src.LCAutomate.product_system.product_system import ProductSystem
-from src.LCAutomate.state import State
+from src.LCAutomate.state import create_state
 from src.olca__patched import ipc as olca
 
-from src.LCAutomate.common_simplified import DRIVER_FILENAME, DriverColumnNames
+from src.LCAutomate.common_simplified import DRIVER_FILENAME, STATE_BACKEND_PICKLE, DriverColumnNames
 from src.LCAutomate.common_simplified import ReplicationColumnNames
 
 from src.LCAutomate.process_hierarchy.single_process_creator import SingleProcessCreator
@@ -16,13 +16,13 @@ RC = ReplicationColumnNames
 
 
 class ProcessHierarchy:
-    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool):
+    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool, state_backend: str = STATE_BACKEND_PICKLE):
         self.client = client
         self.base_root_folder = input_root_folder
         self.restart = restart
         self.top_level_process_uuid = None
         self.template_processes = {}
-        self.state = State(self.base_root_folder)
+        self.state = create_state(self.base_root_folder, state_backend)
 
     def do(self) -> bool:
         if self.restart:
@@ -82,9 +82,9 @@ class ProcessHierarchy:
             template_process.replicants[data_column_name]["process_uuid"] = single_process_creator.created_process_uuid
             template_process.replicants[data_column_name]["process_name"] = single_process_creator.created_process_name
 
-            state_saved = self.save_state()
+            state_saved = self.state.append(template_process.uuid, data_column_name, template_process.replicants[data_column_name])
             if not state_saved:
-                print(f"Failed to save state to {self.state.filename}")
+                print(f"Failed to save state to {self.state.filepath}")
                 return False
 
         return True
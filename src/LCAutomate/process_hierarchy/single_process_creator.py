@@ -167,13 +167,19 @@ class SingleProcessCreator():
         if dqis_sheet_df is not None:
             amounts_sheet_df = self.template_process.replication_file.sheets[RT.AMOUNTS]
             matched_exchange_index_list = self.template_process.matched_exchange_index_list
+
+            # Geometric standard deviations of the whole column at once
+            dqi_codes, base_uncertainties = DQI.get_parsed_dqis(self.template_process.replication_file, data_column_name)
+            openlca_sigma_gs = PedigreeMatrix.sigma_g_many(dqi_codes, base_uncertainties)
+            dqi_strings = dqis_sheet_df[data_column_name].to_list()
+            amounts = amounts_sheet_df[data_column_name].to_list()
             for i in range(dqis_sheet_df.index.size):
                 exchange = cloned_openlca_process.exchanges[matched_exchange_index_list[i]]
     
                 # DQI string
                 # exchange.amount = 0.0 
-                dqi_string = dqis_sheet_df[data_column_name][i]
-                amount = amounts_sheet_df[data_column_name][i]
+                dqi_string = dqi_strings[i]
+                amount = amounts[i]
                 try:
                     if not isinstance(dqi_string, str):
                         # This is often the case, do not print
@@ -184,7 +190,9 @@ class SingleProcessCreator():
                         # print(f"({i + 1}/{dqis_sheet_df.index.size}): {exchange.flow.name} - {dq_entry};{base_uncertainty}", flush=True)
                         exchange.dq_entry = dq_entry
                         exchange.base_uncertainty = base_uncertainty
-                        openlca_sigma_g = PedigreeMatrix.openlca_sigma_g(dq_entry, base_uncertainty)
+                        openlca_sigma_g = float(openlca_sigma_gs[i])
+                        if not math.isfinite(openlca_sigma_g):
+                            raise ValueError(f"Invalid DQI string '{dqi_string}'")
                         exchange.uncertainty.geom_mean = amount
                         exchange.uncertainty.geom_sd = openlca_sigma_g
                 except:
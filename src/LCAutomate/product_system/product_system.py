@@ -2,19 +2,20 @@ import os
 import shutil
 import json
 from src.LCAutomate.calculation.calculation import Calculation
-from src.LCAutomate.state import State
+from src.LCAutomate.state import create_state
+from src.LCAutomate.common_simplified import STATE_BACKEND_PICKLE
 from src.olca__patched import ipc as olca
 from src.olca__patched import schema as olca_schema
 
 
 class ProductSystem:
-    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool):
+    def __init__(self, client: olca.Client, input_root_folder: str, restart: bool, state_backend: str = STATE_BACKEND_PICKLE):
         self.client = client
         self.base_root_folder = input_root_folder
         self.restart = restart
         self.top_level_process_uuid = None
         self.template_processes = {}
-        self.state = State(self.base_root_folder)
+        self.state = create_state(self.base_root_folder, state_backend)
 
     def do(self) -> bool:
         if self.restart:
@@ -80,9 +81,9 @@ class ProductSystem:
             replicant["product_system_uuid"] = product_system_ref.id
             replicant["product_system_name"] = product_system_ref.name
             
-            state_saved = self.save_state()
+            state_saved = self.state.append(self.top_level_process_uuid, data_column_name, replicant)
             if not state_saved:
-                print(f"Failed to save state to {self.state.filename}")
+                print(f"Failed to save state to {self.state.filepath}")
                 return False
         return True
     
@@ -0,0 +1,306 @@
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from src.LCAutomate.common_simplified import STATE_DB_FILENAME, STATE_FILENAME
+from src.LCAutomate.object_store import attach_object_store, prune_object_store
+from src.LCAutomate.state import State
+
+
+# Replicant keys that are stored in their own columns of the replicants table; calculation_files has its own table and
+# any other key is pickled into the extra column
+REPLICANT_COLUMNS = [
+    "input_hash",
+    "process_uuid",
+    "process_name",
+    "product_system_uuid",
+    "product_system_name",
+]
+CALCULATION_FILES = "calculation_files"
+
+# A claim of a replicant by a worker process that has not been released after this many seconds (e.g. because the
+# process was killed) can be taken over by another worker process
+DEFAULT_CLAIM_TIMEOUT = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS template_processes (
+    uuid TEXT PRIMARY KEY,
+    name TEXT,
+    replication_base_name TEXT,
+    position INTEGER
+);
+CREATE TABLE IF NOT EXISTS replicants (
+    template_process_uuid TEXT NOT NULL,
+    data_column_name TEXT NOT NULL,
+    position INTEGER,
+    input_hash TEXT,
+    process_uuid TEXT,
+    process_name TEXT,
+    product_system_uuid TEXT,
+    product_system_name TEXT,
+    extra BLOB,
+    claimed_by TEXT,
+    claimed_at REAL,
+    PRIMARY KEY (template_process_uuid, data_column_name)
+);
+CREATE TABLE IF NOT EXISTS calculation_files (
+    template_process_uuid TEXT NOT NULL,
+    data_column_name TEXT NOT NULL,
+    calculation_type TEXT NOT NULL,
+    impact_assessment_method TEXT NOT NULL,
+    file_key TEXT NOT NULL,
+    filepath TEXT,
+    PRIMARY KEY (template_process_uuid, data_column_name, calculation_type, impact_assessment_method, file_key)
+);
+"""
+
+
+class SQLiteState:
+    # Same interface as State, but kept in a SQLite database with one row per template process, replicant and
+    # calculation file:
+    #   - each append() is one transaction, and save() only writes the replicants that changed since load(), so that
+    #     several worker processes can share the database
+    #   - the stages can query the pending work (get_pending_replicants) and claim replicants (claim_replicant)
+    #     without loading the whole state
+    #   - the template processes themselves (OpenLCA processes and replication sheets) are pickled into one row
+    def __init__(self, input_root_folder: str, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT):
+        self.base_root_folder = input_root_folder
+        self.filepath = os.path.join(self.base_root_folder, STATE_DB_FILENAME)
+        self.claim_timeout = claim_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.connection = None
+        self.is_new = False
+        # Pickled replicants as of the last load/save/append, by (template process uuid, data column name)
+        self.saved_replicants = {}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.is_new = not os.path.exists(self.filepath)
+            self.connection = sqlite3.connect(self.filepath, timeout=60, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def load(self) -> dict:
+        # Load state from previous operations
+        try:
+            with self.lock:
+                connection = self.connect()
+                row = connection.execute("SELECT value FROM state WHERE key = 'model'").fetchone()
+                if row is None:
+                    state = None
+                else:
+                    state = self.read_state(connection, row[0])
+        except Exception as e:
+            print(f"ERROR: Could not read state from {self.filepath}: {e}")
+            return None
+
+        if state is None and self.is_new:
+            # Import the state of the pickle backend, if there is one
+            state = State(self.base_root_folder).load()
+            if state is not None:
+                print(f"Importing state from {STATE_FILENAME} into {STATE_DB_FILENAME}", flush=True)
+                if not self.save(state):
+                    return None
+        return state
+
+    def read_state(self, connection: sqlite3.Connection, model: bytes) -> dict:
+        top_level_process_uuid, template_processes = pickle.loads(model)
+        attach_object_store(template_processes, self.base_root_folder)
+        replicants = {}
+        rows = connection.execute(
+            "SELECT template_process_uuid, data_column_name, extra, " + ", ".join(REPLICANT_COLUMNS) +
+            " FROM replicants ORDER BY template_process_uuid, position"
+        )
+        for row in rows:
+            replicant = pickle.loads(row[2]) if row[2] is not None else {}
+            for column_name, value in zip(REPLICANT_COLUMNS, row[3:]):
+                if value is not None:
+                    replicant[column_name] = value
+            replicants[(row[0], row[1])] = replicant
+
+        rows = connection.execute(
+            "SELECT template_process_uuid, data_column_name, calculation_type, impact_assessment_method, file_key, "
+            "filepath FROM calculation_files ORDER BY rowid"
+        )
+        for template_process_uuid, data_column_name, calculation_type, impact_assessment_method, file_key, filepath in rows:
+            replicant = replicants.get((template_process_uuid, data_column_name), None)
+            if replicant is None:
+                continue
+            calculation_files = replicant.setdefault(CALCULATION_FILES, {})
+            calculation_files.setdefault(calculation_type, {}).setdefault(impact_assessment_method, {})[file_key] = filepath
+
+        self.saved_replicants = {}
+        for uuid, template_process in template_processes.items():
+            for data_column_name in template_process.replicants.keys():
+                replicant = replicants.get((uuid, data_column_name), None)
+                template_process.replicants[data_column_name] = replicant
+                self.saved_replicants[(uuid, data_column_name)] = pickle.dumps(replicant)
+
+        return {
+            "top_level_process_uuid": top_level_process_uuid,
+            "template_processes": template_processes,
+        }
+
+    def save(self, state: dict) -> bool:
+        # Save state for use in subsequent operations, in one transaction
+        #   - only the replicants that changed since they were loaded are written, so that the replicants updated by
+        #     other worker processes in the meantime are kept
+        template_processes = state["template_processes"]
+        try:
+            model = self.pickle_model(state["top_level_process_uuid"], template_processes)
+            with self.lock:
+                connection = self.connect()
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('model', ?)", (model,))
+                    connection.execute("DELETE FROM template_processes")
+                    connection.executemany(
+                        "INSERT INTO template_processes (uuid, name, replication_base_name, position) VALUES (?, ?, ?, ?)",
+                        [(uuid, template_process.name, template_process.replication_base_name, position)
+                         for position, (uuid, template_process) in enumerate(template_processes.items())]
+                    )
+
+                    keys = set()
+                    for uuid, template_process in template_processes.items():
+                        for position, (data_column_name, replicant) in enumerate(template_process.replicants.items()):
+                            key = (uuid, data_column_name)
+                            keys.add(key)
+                            pickled_replicant = pickle.dumps(replicant)
+                            if self.saved_replicants.get(key, None) != pickled_replicant:
+                                self.write_replicant(connection, uuid, data_column_name, replicant, position)
+                                self.saved_replicants[key] = pickled_replicant
+
+                    # Replicants of data columns or template processes that are no longer in the model
+                    rows = connection.execute("SELECT template_process_uuid, data_column_name FROM replicants").fetchall()
+                    for key in rows:
+                        if tuple(key) not in keys:
+                            connection.execute(
+                                "DELETE FROM replicants WHERE template_process_uuid = ? AND data_column_name = ?", key)
+                            connection.execute(
+                                "DELETE FROM calculation_files WHERE template_process_uuid = ? AND data_column_name = ?", key)
+                            self.saved_replicants.pop(tuple(key), None)
+            prune_object_store(template_processes, self.base_root_folder)
+            return True
+        except Exception as e:
+            print(f"ERROR: Could not write state to {self.filepath}: {e}")
+            return False
+
+    def append(self, template_process_uuid: str, data_column_name: str, replicant: dict) -> bool:
+        # Record the update of a single replicant, in one transaction
+        try:
+            with self.lock:
+                connection = self.connect()
+                with connection:
+                    self.write_replicant(connection, template_process_uuid, data_column_name, replicant)
+                self.saved_replicants[(template_process_uuid, data_column_name)] = pickle.dumps(replicant)
+            return True
+        except Exception as e:
+            print(f"ERROR: Could not write state to {self.filepath}: {e}")
+            return False
+
+    def write_replicant(self, connection: sqlite3.Connection, template_process_uuid: str, data_column_name: str,
+                        replicant: dict, position: int = None):
+        if replicant is None:
+            replicant = {}
+        extra = {key: value for key, value in replicant.items()
+                 if key not in REPLICANT_COLUMNS and key != CALCULATION_FILES}
+        values = [replicant.get(column_name, None) for column_name in REPLICANT_COLUMNS]
+        if position is None:
+            position = connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM replicants WHERE template_process_uuid = ?",
+                (template_process_uuid,)
+            ).fetchone()[0]
+        connection.execute(
+            "INSERT INTO replicants (template_process_uuid, data_column_name, position, extra, " +
+            ", ".join(REPLICANT_COLUMNS) + ") VALUES (?, ?, ?, ?" + ", ?" * len(REPLICANT_COLUMNS) + ") "
+            "ON CONFLICT (template_process_uuid, data_column_name) DO UPDATE SET extra = excluded.extra, " +
+            ", ".join(f"{column_name} = excluded.{column_name}" for column_name in REPLICANT_COLUMNS),
+            [template_process_uuid, data_column_name, position, pickle.dumps(extra) if extra else None] + values
+        )
+
+        key = (template_process_uuid, data_column_name)
+        connection.execute("DELETE FROM calculation_files WHERE template_process_uuid = ? AND data_column_name = ?", key)
+        rows = []
+        for calculation_type, calculation_type_group in (replicant.get(CALCULATION_FILES, None) or {}).items():
+            for impact_assessment_method, calculation_files in (calculation_type_group or {}).items():
+                for file_key, filepath in (calculation_files or {}).items():
+                    rows.append(key + (calculation_type, impact_assessment_method, file_key, filepath))
+        connection.executemany(
+            "INSERT INTO calculation_files (template_process_uuid, data_column_name, calculation_type, "
+            "impact_assessment_method, file_key, filepath) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def pickle_model(self, top_level_process_uuid: str, template_processes: dict) -> bytes:
+        # The replicants are kept in their own rows, so they are left out of the pickled template processes
+        replicants = {}
+        try:
+            for uuid, template_process in template_processes.items():
+                replicants[uuid] = template_process.replicants
+                template_process.replicants = {data_column_name: None for data_column_name in replicants[uuid].keys()}
+            return pickle.dumps((top_level_process_uuid, template_processes))
+        finally:
+            for uuid, template_process_replicants in replicants.items():
+                template_processes[uuid].replicants = template_process_replicants
+
+    def get_pending_replicants(self, template_process_uuid: str, calculation_type: str,
+                               impact_assessment_method: str) -> list:
+        # Returns the data column names of the replicants that have no calculation files for the calculation type and
+        # impact assessment method, in data column order
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT data_column_name FROM replicants r WHERE template_process_uuid = ? "
+                "AND NOT EXISTS (SELECT 1 FROM calculation_files f "
+                "WHERE f.template_process_uuid = r.template_process_uuid AND f.data_column_name = r.data_column_name "
+                "AND f.calculation_type = ? AND f.impact_assessment_method = ?) ORDER BY position",
+                (template_process_uuid, calculation_type, impact_assessment_method)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_replicant(self, template_process_uuid: str, data_column_name: str, calculation_type: str,
+                        impact_assessment_method: str) -> bool:
+        # Claims the calculation of a replicant for this worker process; False if another worker process holds the
+        # claim or the calculation files already exist
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                cursor = connection.execute(
+                    "UPDATE replicants SET claimed_by = ?, claimed_at = ? "
+                    "WHERE template_process_uuid = ? AND data_column_name = ? "
+                    "AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?) "
+                    "AND NOT EXISTS (SELECT 1 FROM calculation_files f WHERE f.template_process_uuid = ? "
+                    "AND f.data_column_name = ? AND f.calculation_type = ? AND f.impact_assessment_method = ?)",
+                    (self.worker_id, now, template_process_uuid, data_column_name, self.worker_id,
+                     now - self.claim_timeout, template_process_uuid, data_column_name, calculation_type,
+                     impact_assessment_method)
+                )
+            return cursor.rowcount == 1
+
+    def release_replicant(self, template_process_uuid: str, data_column_name: str):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "UPDATE replicants SET claimed_by = NULL, claimed_at = NULL "
+                    "WHERE template_process_uuid = ? AND data_column_name = ? AND claimed_by = ?",
+                    (template_process_uuid, data_column_name, self.worker_id)
+                )
+
+    def delete(self) -> bool:
+        try:
+            with self.lock:
+                connection = self.connect()
+                with connection:
+                    for table in ["state", "template_processes", "replicants", "calculation_files"]:
+                        connection.execute(f"DELETE FROM {table}")
+                self.saved_replicants = {}
+            return True
+        except:
+            return False
@@ -1,34 +1,125 @@
 import os
 import pickle
-from src.LCAutomate.common_simplified import STATE_FILENAME
+from src.LCAutomate.common_simplified import STATE_FILENAME, STATE_BACKEND_SQLITE, STATE_BACKEND_PICKLE
+from src.LCAutomate.object_store import attach_object_store, prune_object_store
 
 
 class State:
     def __init__(self, input_root_folder: str):
         self.base_root_folder = input_root_folder
         self.filepath = os.path.join(self.base_root_folder, STATE_FILENAME)
+        # Replicant updates since the last full save, see append()
+        self.journal_filepath = f"{self.filepath}.journal"
 
     def load(self) -> dict:
         # Load state from previous operations
         try:
             with open(self.filepath, "rb") as f:
                 state = pickle.load(f)
-            return state
         except:
             return None
-    
+        attach_object_store(state["template_processes"], self.base_root_folder)
+        self.replay_journal(state)
+        return state
+
     def save(self, state: dict) -> bool:
         # Save state for use in subsequent operations
+        #   - written to a temporary file first and then renamed, so that a crash never leaves a partial state file
+        #   - the journal is compacted into the saved state, so it is removed afterwards
+        temp_filepath = f"{self.filepath}.tmp"
         try:
-            with open(self.filepath, "wb") as f:
+            with open(temp_filepath, "wb") as f:
                 pickle.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filepath, self.filepath)
+        except:
+            return False
+        prune_object_store(state["template_processes"], self.base_root_folder)
+        try:
+            os.unlink(self.journal_filepath)
+        except FileNotFoundError:
+            pass
+        except:
+            return False
+        return True
+
+    def append(self, template_process_uuid: str, data_column_name: str, replicant: dict) -> bool:
+        # Record the update of a single replicant instead of rewriting the whole state
+        #   - the records are appended to the journal and replayed on top of the saved state by load()
+        #   - a stage calls save() when it completes, which compacts the journal
+        record = (template_process_uuid, data_column_name, replicant)
+        try:
+            with open(self.journal_filepath, "ab") as f:
+                f.write(pickle.dumps(record))
+                f.flush()
+                os.fsync(f.fileno())
             return True
         except:
             return False
 
+    def replay_journal(self, state: dict):
+        template_processes = state["template_processes"]
+        try:
+            f = open(self.journal_filepath, "rb")
+        except FileNotFoundError:
+            return
+        torn_offset = None
+        with f:
+            while True:
+                offset = f.tell()
+                try:
+                    template_process_uuid, data_column_name, replicant = pickle.load(f)
+                except EOFError:
+                    if f.tell() != offset:
+                        torn_offset = offset
+                    break
+                except Exception:
+                    torn_offset = offset
+                    break
+                template_process = template_processes.get(template_process_uuid, None)
+                if template_process is not None:
+                    template_process.replicants[data_column_name] = replicant
+
+        if torn_offset is not None:
+            # A record torn by a crash while it was appended; the records before it are intact.  It is cut off so that
+            # the records appended from now on can be replayed
+            print(f"WARNING: Ignoring incomplete record at the end of {self.journal_filepath}", flush=True)
+            try:
+                with open(self.journal_filepath, "r+b") as f:
+                    f.truncate(torn_offset)
+            except:
+                pass
+
+    def get_pending_replicants(self, template_process_uuid: str, calculation_type: str,
+                               impact_assessment_method: str) -> list:
+        # The pickle state cannot be queried, the stages look for the pending work in the loaded state
+        return None
+
+    def claim_replicant(self, template_process_uuid: str, data_column_name: str, calculation_type: str,
+                        impact_assessment_method: str) -> bool:
+        # Only one process works on the pickle state, see SQLiteState for claims across processes
+        return True
+
+    def release_replicant(self, template_process_uuid: str, data_column_name: str):
+        pass
+
     def delete(self) -> bool:
+        try:
+            os.unlink(self.journal_filepath)
+        except FileNotFoundError:
+            pass
+        except:
+            return False
         try:
             os.unlink(self.filepath)
             return True
         except:
             return False
+
+
+def create_state(input_root_folder: str, backend: str = STATE_BACKEND_PICKLE):
+    if backend == STATE_BACKEND_SQLITE:
+        from src.LCAutomate.sqlite_state import SQLiteState
+        return SQLiteState(input_root_folder)
+    return State(input_root_folder)
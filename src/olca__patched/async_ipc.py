@@ -0,0 +1,177 @@
+import asyncio
+import logging as log
+import time
+
+import src.olca__patched.schema as schema
+
+from src.olca__patched.ipc import Client, E, ModelType
+
+from typing import Any, List, Optional, Tuple, Type
+
+
+class AsyncClient(object):
+    """
+    An asyncio client to communicate with an openLCA IPC server.
+
+    It has the same surface as `Client`, but its methods are coroutines, so
+    that many independent requests can be in flight at the same time. The
+    requests are sent by a `Client` with a connection pool of
+    `max_concurrency` connections, each in a worker thread.
+
+    Parameters
+    ----------
+
+    port: int, optional
+        The port of the server connection; optional, defaults to 8080.
+
+    max_concurrency: int, optional
+        The maximum number of requests in flight at the same time; optional,
+        defaults to 8.
+
+    client: Client, optional
+        An existing client to send the requests with; optional. If it is not
+        given a new client is created with a pool of `max_concurrency`
+        connections.
+
+    Example
+    -------
+    ```python
+    import asyncio
+    import olca__patched as olca
+    from olca__patched.async_ipc import AsyncClient
+
+    async def main():
+        async with AsyncClient(8080, max_concurrency=4) as client:
+            flows = await asyncio.gather(
+                *[client.get(olca.Flow, uid) for uid in flow_ids])
+
+    asyncio.run(main())
+    ```
+    """
+
+    def __init__(self, port: int = 8080, max_concurrency: int = 8,
+                 client: Optional[Client] = None):
+        if client is None:
+            client = Client(port, pool_size=max_concurrency)
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Release the pooled connections to the IPC server."""
+        self.client.close()
+
+    async def rpc(self, method: str, params) -> Tuple[Any, Optional[str]]:
+        """
+        Call the given JSON-RPC method of the IPC server, see `Client.rpc`.
+        It returns a tuple (result, error).
+        """
+        return await self.__run(self.client.rpc, method, params)
+
+    async def insert(self, model: E):
+        """See `Client.insert`."""
+        return await self.__run(self.client.insert, model)
+
+    async def update(self, model: E):
+        """See `Client.update`."""
+        return await self.__run(self.client.update, model)
+
+    async def delete(self, model: E):
+        """See `Client.delete`."""
+        return await self.__run(self.client.delete, model)
+
+    async def get(self, model_type: Type[E], uid='', name='',
+                  cached=False) -> Optional[E]:
+        """See `Client.get`."""
+        return await self.__run(self.client.get, model_type, uid, name, cached)
+
+    async def get_many(self, model_type: Type[E], uids: List[str],
+                       cached=False) -> List[Tuple[Optional[E], Optional[str]]]:
+        """See `Client.get_many`."""
+        return list(await asyncio.gather(*[
+            self.__run(self.client.get_with_error, model_type, uid, '', cached) for uid in uids
+        ]))
+
+    async def find(self, model_type: ModelType, name: str) -> Optional[schema.Ref]:
+        """See `Client.find`."""
+        return await self.__run(self.client.find, model_type, name)
+
+    async def create_product_system(self, process_id: str, default_providers='prefer',
+                                    preferred_type='LCI_RESULT') -> Optional[schema.Ref]:
+        """See `Client.create_product_system`."""
+        return await self.__run(
+            self.client.create_product_system, process_id, default_providers, preferred_type)
+
+    async def calculate(self, setup: schema.CalculationSetup) -> Tuple[Any, Optional[str]]:
+        """
+        See `Client.calculate`. Waiting for the result does not hold one of
+        the `max_concurrency` request slots.
+        """
+        resp, err = await self.rpc('result/calculate', setup.to_json())
+        if err:
+            log.error('calculation failed: %s', err)
+            return resp, err
+        return await self.__wait_until_ready(resp, 'calculation')
+
+    async def simulator(self, setup: schema.CalculationSetup) -> Tuple[Any, Optional[str]]:
+        """See `Client.simulator`."""
+        resp, err = await self.rpc('result/simulate', setup.to_json())
+        if err:
+            log.error('failed to create simulator: %s', err)
+            return schema.Ref(), err
+        return resp, err
+
+    async def next_simulation(self, simulator: schema.Ref) -> Tuple[Any, Optional[str]]:
+        """See `Client.next_simulation`."""
+        if simulator is None:
+            raise ValueError('No simulator given')
+        resp, err = await self.rpc('result/simulate/next', simulator.to_json())
+        if err:
+            log.error('next_simulation failed: %s', err)
+            return resp, err
+        return await self.__wait_until_ready(resp, 'next_simulation')
+
+    async def result(self, result_specifier: str, params: dict) -> Tuple[Any, Optional[str]]:
+        """
+        Query a detail of a calculated result, e.g.
+        `await client.result('result/total-impacts', {'@id': result_id})`.
+        See `Client.json_export_result_detail` for the available specifiers.
+        """
+        return await self.rpc(result_specifier, params)
+
+    async def dispose(self, params: dict):
+        """See `Client.dispose`."""
+        return await self.__run(self.client.dispose, params)
+
+    async def __wait_until_ready(self, resp: dict, label: str) -> Tuple[Any, Optional[str]]:
+        # Same polling policy as `Client.wait_until_ready`
+        start = time.monotonic()
+        err = None
+        delays = self.client.poll_backoff.delays()
+        while resp.get('isReady') == False:
+            elapsed = time.monotonic() - start
+            if self.client.poll_timeout is not None and elapsed > self.client.poll_timeout:
+                err = 'result not ready after %.1f s' % elapsed
+                log.error('%s failed: %s', label, err)
+                return resp, err
+            await asyncio.sleep(next(delays))
+            resp, err = await self.rpc('result/state', resp)
+            log.debug('%s state: %s', label, resp)
+            if err:
+                log.error('%s failed: %s', label, err)
+                return resp, err
+        time_to_ready = time.monotonic() - start
+        print(f"{label} ready after {time_to_ready:.3f} s", flush=True)
+        return resp, err
+
+    async def __run(self, fn, *args):
+        # The blocking call runs in a worker thread; the semaphore bounds the
+        # number of calls in flight
+        async with self.__semaphore:
+            return await asyncio.to_thread(fn, *args)
@@ -0,0 +1,132 @@
+import threading
+
+import src.olca__patched.schema as schema
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class DescriptorIndex(object):
+    """
+    An in-memory index of the descriptors of one model type, keyed by name
+    and by ID.
+
+    The index is filled once from the `data/get/descriptors` response and
+    then kept up to date by the client on insert, update and delete, so
+    that repeated lookups by name do not go back to the IPC server.
+    """
+
+    def __init__(self, descriptors: Iterable[schema.Ref]):
+        self.by_id: Dict[str, schema.Ref] = {}
+        self.by_name: Dict[str, List[schema.Ref]] = {}
+        for descriptor in descriptors:
+            self.put(descriptor)
+
+    def find(self, name: str) -> Optional[schema.Ref]:
+        """Returns the first descriptor with the given name or `None`."""
+        descriptors = self.by_name.get(name)
+        if not descriptors:
+            return None
+        return descriptors[0]
+
+    def get(self, uid: str) -> Optional[schema.Ref]:
+        """Returns the descriptor with the given ID or `None`."""
+        return self.by_id.get(uid)
+
+    def put(self, descriptor: schema.Ref):
+        """Adds the descriptor to the index or replaces the existing one."""
+        if descriptor is None or descriptor.id is None:
+            return
+        self.remove(descriptor.id)
+        self.by_id[descriptor.id] = descriptor
+        self.by_name.setdefault(descriptor.name, []).append(descriptor)
+
+    def remove(self, uid: str):
+        """Removes the descriptor with the given ID, if it is indexed."""
+        descriptor = self.by_id.pop(uid, None)
+        if descriptor is None:
+            return
+        descriptors = self.by_name.get(descriptor.name, [])
+        self.by_name[descriptor.name] = [d for d in descriptors if d.id != uid]
+        if not self.by_name[descriptor.name]:
+            del self.by_name[descriptor.name]
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+class EntityCache(object):
+    """
+    A bounded cache of entities fetched from the IPC server, keyed by model
+    type and ID. When the cache is full the least recently used entity is
+    evicted.
+
+    Attributes
+    ----------
+    max_size: int
+        The maximum number of entities held in the cache.
+
+    hits: int
+        The number of lookups that were answered from the cache.
+
+    misses: int
+        The number of lookups that were not in the cache.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__entries: OrderedDict[Tuple[str, str], Any] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, type_name: str, uid: str) -> Optional[Any]:
+        """Returns the cached entity or `None`, counting a hit or a miss."""
+        key = (type_name, uid)
+        with self.__lock:
+            entity = self.__entries.get(key)
+            if entity is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entity
+
+    def put(self, type_name: str, uid: str, entity: Any):
+        """Adds the entity, evicting the least recently used one if full."""
+        if entity is None or self.max_size <= 0:
+            return
+        key = (type_name, uid)
+        with self.__lock:
+            self.__entries[key] = entity
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def reserve(self, size: int):
+        """
+        Grows the cache so that it holds at least `size` entities, e.g. before
+        a prefetch that must not evict its own entries. A larger `max_size`
+        is kept.
+        """
+        with self.__lock:
+            self.max_size = max(self.max_size, size)
+
+    def remove(self, type_name: str, uid: str):
+        """Removes the entity, if it is cached."""
+        with self.__lock:
+            self.__entries.pop((type_name, uid), None)
+
+    def clear(self):
+        """Removes all entities and resets the hit and miss counters."""
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __str__(self):
+        return '%i hits, %i misses, %i of %i entries' % (
+            self.hits, self.misses, len(self.__entries), self.max_size)
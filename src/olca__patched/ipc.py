@@ -1,13 +1,22 @@
 import logging as log
 import os
+import threading
 import time
 import json
 import requests
+from requests.adapters import HTTPAdapter
 
 import src.olca__patched as olca
 import src.olca__patched.schema as schema
 import src.olca__patched.upstream_tree as utree
 
+from src.olca__patched.cache import DescriptorIndex, EntityCache
+from src.olca__patched.polling import Backoff
+from src.olca__patched.resilience import CircuitBreaker, is_read_only
+from src.olca__patched.upstream_traversal import UpstreamLimits, merge_tech_flows, share_of, upstream_path
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 from typing import Any, Iterator, List, Optional, Tuple, Type, TypeVar, Union
@@ -160,20 +169,122 @@ class Client(object):
 
     port: int, optional
         The port of the server connection; optional, defaults to 8080.
+
+    pool_size: int, optional
+        The maximum number of keep-alive connections that are held open to
+        the server; optional, defaults to 10.
+
+    connect_timeout: float, optional
+        The number of seconds to wait for a connection to the server;
+        optional, defaults to 10.
+
+    read_timeout: float, optional
+        The number of seconds to wait for a response from the server; optional,
+        defaults to `None` which means wait forever.
+
+    entity_cache_size: int, optional
+        The maximum number of entities kept in the entity cache that is used
+        by `get(..., cached=True)`; optional, defaults to 1024.
+
+    poll_backoff: Backoff, optional
+        The delays between two `result/state` polls while waiting for a
+        calculation; optional, defaults to 5 ms doubling up to 2 s.
+
+    poll_timeout: float, optional
+        The number of seconds after which waiting for a calculation is given
+        up; optional, defaults to `None` which means wait forever.
+
+    retries: int, optional
+        The number of times a read-only request (`data/get...`, `get/...`,
+        `result/...` queries) is repeated after a connection error, timeout
+        or 5xx response; optional, defaults to 3. Requests that change data
+        or start calculations are never repeated.
+
+    retry_backoff: Backoff, optional
+        The jittered delays between two attempts; optional, defaults to 0.5 s
+        doubling up to 10 s.
+
+    circuit_breaker: CircuitBreaker, optional
+        Pauses all requests while the server is unhealthy; optional, defaults
+        to opening after 5 consecutive failures for 30 s.
+
+    export_concurrency: int, optional
+        The maximum number of impact categories whose result details are
+        exported in parallel, shared by all threads that use this client;
+        optional, defaults to `pool_size`.
+
+    upstream_limits: UpstreamLimits, optional
+        The depth, minimum contribution share and maximum node count of the
+        upstream export, see `go_farther_upstream`; optional, defaults to
+        `MAX_DEPTH` levels without pruning.
     """
 
-    def __init__(self, port: int = 8080):
+    def __init__(self, port: int = 8080, pool_size: int = 10,
+                 connect_timeout: Optional[float] = 10.0,
+                 read_timeout: Optional[float] = None,
+                 entity_cache_size: int = 1024,
+                 poll_backoff: Optional[Backoff] = None,
+                 poll_timeout: Optional[float] = None,
+                 retries: int = 3,
+                 retry_backoff: Optional[Backoff] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 export_concurrency: Optional[int] = None,
+                 upstream_limits: Optional[UpstreamLimits] = None):
         self.url = 'http://localhost:%i' % port
         self.next_id = 1
+        self.id_lock = threading.Lock()
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        # A single session keeps the TCP connections to the IPC server alive
+        # between calls instead of opening a new connection per request. The
+        # pool blocks when all `pool_size` connections are in use, so that the
+        # nested thread pools of the workers, the parallel export and `batch`
+        # share them instead of opening and discarding extra connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+
+        # Descriptor indices by model type, see `descriptor_index`
+        self.descriptor_indices = {}
+
+        # Entities that were requested with `get(..., cached=True)`
+        self.entity_cache = EntityCache(entity_cache_size)
+
+        # Polling of results that are not ready yet, see `wait_until_ready`
+        self.poll_backoff = poll_backoff if poll_backoff is not None else Backoff()
+        self.poll_timeout = poll_timeout
+        self.last_time_to_ready = None
+
+        # Recovery from transient failures, see `__post`
+        self.retries = retries
+        self.retry_backoff = retry_backoff if retry_backoff is not None \
+            else Backoff(initial=0.5, factor=2.0, max_delay=10.0, jitter=0.5)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None \
+            else CircuitBreaker()
+        self.failure_counts = Counter()
+        self.failure_counts_lock = threading.Lock()
+
+        # Cleared when the server rejects a JSON-RPC batch, see `batch`
+        self.batch_supported = True
+
+        # Parallel export of result details per impact category
+        self.export_concurrency = export_concurrency if export_concurrency is not None \
+            else pool_size
+        self.export_slots = threading.BoundedSemaphore(self.export_concurrency)
+        self.upstream_limits = upstream_limits if upstream_limits is not None \
+            else UpstreamLimits(max_depth=MAX_DEPTH)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        return
+        self.close()
 
     def close(self):
-        return
+        """Release the pooled connections to the IPC server."""
+        self.session.close()
 
     def insert(self, model: E):
         """
@@ -210,6 +321,8 @@ class Client(object):
         if err:
             log.error('failed to insert model: %s', err)
             return err
+        self.__index_put(json['@type'], resp, json.get('name'))
+        self.entity_cache.remove(json['@type'], model.id)
         return resp
 
     def update(self, model: E):
@@ -223,6 +336,8 @@ class Client(object):
         if err:
             log.error('failed to update model: %s', err)
             return err
+        self.__index_put(json['@type'], resp, json.get('name'))
+        self.entity_cache.remove(json['@type'], model.id)
         return resp
 
     def delete(self, model: E):
@@ -237,6 +352,10 @@ class Client(object):
         if err:
             log.error('failed to delete model: %s', err)
             return err
+        index = self.descriptor_indices.get(json['@type'])
+        if index is not None:
+            index.remove(model.id)
+        self.entity_cache.remove(json['@type'], model.id)
         return resp
 
     def calculate(self, setup: schema.CalculationSetup) -> Tuple[Any, Optional[str]]:
@@ -272,18 +391,10 @@ class Client(object):
         ```
         """
         resp, err = self.__post('result/calculate', setup.to_json())
-        print(resp, flush=True)
         if err:
             log.error('calculation failed: %s', err)
             return resp, err
-        while resp.get('isReady') == False:
-            time.sleep(2)
-            resp, err = self.__post('result/state', resp)
-            print(resp, flush=True)
-            if err:
-                log.error('calculation failed: %s', err)
-                return resp, err
-        return resp, err
+        return self.wait_until_ready(resp, 'calculation')
 
     def simulator(self, setup: schema.CalculationSetup) -> schema.Ref:
         """
@@ -358,24 +469,46 @@ class Client(object):
             raise ValueError('No simulator given')
 
         resp, err = self.__post('result/simulate/next', simulator.to_json())
-        print(resp, flush=True)
         if err:
             log.error('next_simulation failed: %s', err)
             return resp, err
-        while resp.get('isReady') == False:
-            time.sleep(2)
-            resp, err = self.__post('result/state', resp)
-            print(resp, flush=True)
-            if err:
-                log.error('next_simulation failed: %s', err)
-                return resp, err
-        return resp, err
+        return self.wait_until_ready(resp, 'next_simulation')
 
         # if err:
         #     log.error('failed to get simulation result: %s', err)
         #     return schema.SimpleResult()
         # return schema.SimpleResult.from_json(resp)
 
+    def wait_until_ready(self, resp: dict, label: str = 'calculation') -> Tuple[Any, Optional[str]]:
+        """
+        Poll `result/state` until the given result state is ready.
+
+        The delay between two polls follows `poll_backoff`, so results that
+        are ready after a few milliseconds are not held back by a long fixed
+        sleep. The time until the result was ready is printed and kept in
+        `last_time_to_ready`.
+
+        It returns a tuple (result state, error).
+        """
+        start = time.monotonic()
+        err = None
+        delays = self.poll_backoff.delays()
+        while resp.get('isReady') == False:
+            elapsed = time.monotonic() - start
+            if self.poll_timeout is not None and elapsed > self.poll_timeout:
+                err = 'result not ready after %.1f s' % elapsed
+                log.error('%s failed: %s', label, err)
+                return resp, err
+            time.sleep(next(delays))
+            resp, err = self.__post('result/state', resp)
+            log.debug('%s state: %s', label, resp)
+            if err:
+                log.error('%s failed: %s', label, err)
+                return resp, err
+        self.last_time_to_ready = time.monotonic() - start
+        print(f"{label} ready after {self.last_time_to_ready:.3f} s", flush=True)
+        return resp, err
+
     def get_descriptors(self, model_type: ModelType) -> Iterator[schema.Ref]:
         """
         Get the descriptors of the entities with the type from the database.
@@ -462,18 +595,115 @@ class Client(object):
         return schema.Ref.from_json(result)
 
     def get(self, model_type: Type[E],
-            uid='', name='') -> Optional[E]:
-        params = {'@type': _model_type(model_type)}
+            uid='', name='', cached=False) -> Optional[E]:
+        """
+        Get the entity with the given type and ID or name from the database.
+
+        Parameters
+        ----------
+        model_type: Type[E]
+            The model type, e.g. olca.Flow
+        uid: str, optional
+            The ID of the entity.
+        name: str, optional
+            The name of the entity.
+        cached: bool, optional
+            If `True`, an entity requested by ID is looked up in the entity
+            cache first and stored there after it was fetched. The cached
+            instance is shared between callers and must not be modified.
+            Defaults to `False`.
+        """
+        entity, err = self.__get(model_type, uid, name, cached)
+        if err:
+            log.error('failed to get entity of type %s: %s',
+                      model_type, err)
+        return entity
+
+    def get_with_error(self, model_type: Type[E], uid='', name='',
+                       cached=False) -> Tuple[Optional[E], Optional[str]]:
+        """
+        Get the entity with the given type and ID or name from the database,
+        like `get`, but return the error instead of logging it.
+
+        Parameters
+        ----------
+        model_type: Type[E]
+            The model type, e.g. olca.Flow
+        uid: str, optional
+            The ID of the entity.
+        name: str, optional
+            The name of the entity.
+        cached: bool, optional
+            Use the entity cache as in `get`. Defaults to `False`.
+
+        Returns
+        -------
+        Tuple[Optional[E], Optional[str]]
+            The entity and `None`, or `None` and the error.
+        """
+        return self.__get(model_type, uid, name, cached)
+
+    def get_many(self, model_type: Type[E], uids: List[str],
+                 cached=False) -> List[Tuple[Optional[E], Optional[str]]]:
+        """
+        Get the entities with the given type and IDs from the database.
+
+        The requests are sent concurrently over the pooled connections of
+        this client, with at most `pool_size` requests in flight.
+
+        Parameters
+        ----------
+        model_type: Type[E]
+            The model type, e.g. olca.Process
+        uids: List[str]
+            The IDs of the entities.
+        cached: bool, optional
+            Use the entity cache as in `get`. Defaults to `False`.
+
+        Returns
+        -------
+        List[Tuple[Optional[E], Optional[str]]]
+            A tuple (entity, error) for each ID, in the order of `uids`.
+
+        Example
+        -------
+        ```python
+        client = olca.Client()
+        for process, err in client.get_many(olca.Process, process_ids):
+            if err:
+                print(err)
+        ```
+        """
+        def get_one(uid: str):
+            return self.__get(model_type, uid, '', cached)
+
+        if len(uids) == 0:
+            return []
+        workers = max(1, min(self.pool_size, len(uids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(get_one, uids))
+
+    def __get(self, model_type: Type[E], uid: str, name: str,
+              cached: bool) -> Tuple[Optional[E], Optional[str]]:
+        type_name = _model_type(model_type)
+        use_cache = cached and uid != ''
+        if use_cache:
+            entity = self.entity_cache.get(type_name, uid)
+            if entity is not None:
+                return entity, None
+
+        params = {'@type': type_name}
         if uid != '':
             params['@id'] = uid
         if name != '':
             params['name'] = name
         result, err = self.__post('data/get', params)
         if err:
-            log.error('failed to get entity of type %s: %s',
-                      model_type, err)
-            return None
-        return _model_class(model_type).from_json(result)
+            return None, err
+        entity = _model_class(model_type).from_json(result)
+        if use_cache:
+            self.entity_cache.put(type_name, uid, entity)
+        return entity, None
 
     def get_all(self, model_type: Type[E]) -> Iterator[E]:
         """
@@ -505,15 +735,76 @@ class Client(object):
     def find(self, model_type: ModelType, name: str) -> Optional[schema.Ref]:
         """Searches for a data set with the given type and name.
 
+        The lookup is done in the descriptor index of the model type, which is
+        loaded from the server on first use (see `descriptor_index`).
+
         :param model_type: The class of the data set, e.g. `olca.Flow`.
         :param name: The name of the data set.
         :return: The reference to the first data set with the given name and
                  type from the databases or ``None`` if there is no such data
                  set in the database.
         """
-        for d in self.get_descriptors(model_type):
-            if d.name == name:
-                return d
+        index = self.descriptor_index(model_type)
+        if index is None:
+            return None
+        return index.find(name)
+
+    def descriptor_index(self, model_type: ModelType) -> Optional[DescriptorIndex]:
+        """
+        Get the descriptor index of the given model type.
+
+        The index is built from a single `data/get/descriptors` call the first
+        time it is requested. After that it is updated by `insert`, `update`,
+        `delete` and `create_product_system` of this client, so lookups by
+        name or ID do not go back to the server. Changes made by other clients
+        (e.g. in the openLCA UI) are not seen until `invalidate_descriptors`
+        is called.
+
+        Parameters
+        ----------
+        model_type: ModelType
+            The model type, e.g. olca.Process or `'Process'`
+
+        Returns
+        -------
+        DescriptorIndex
+            The index, or `None` if the descriptors could not be loaded.
+        """
+        type_name = _model_type(model_type)
+        index = self.descriptor_indices.get(type_name)
+        if index is not None:
+            return index
+
+        result, err = self.__post('data/get/descriptors', {'@type': type_name})
+        if err:
+            log.error('failed to get descriptors of type %s: %s',
+                      type_name, err)
+            return None
+        index = DescriptorIndex(schema.Ref.from_json(r) for r in result)
+        self.descriptor_indices[type_name] = index
+        return index
+
+    def invalidate_descriptors(self, model_type: Optional[ModelType] = None):
+        """
+        Drop the descriptor index of the given model type, or of all types if
+        no type is given. The index is reloaded on the next lookup.
+        """
+        if model_type is None:
+            self.descriptor_indices.clear()
+        else:
+            self.descriptor_indices.pop(_model_type(model_type), None)
+
+    def __index_put(self, type_name: str, ref_json: dict, name: Optional[str] = None):
+        # Keep an already loaded descriptor index in sync with a data set that
+        # was written through this client
+        index = self.descriptor_indices.get(type_name)
+        if index is None or not isinstance(ref_json, dict):
+            return
+        descriptor = schema.Ref.from_json(ref_json)
+        descriptor.olca_type = type_name
+        if descriptor.name is None:
+            descriptor.name = name
+        index.put(descriptor)
 
     def get_providers_of(self, flow: Union[schema.Ref, schema.Flow]) \
             -> Iterator[schema.Ref]:
@@ -640,41 +931,93 @@ class Client(object):
         file.close()
         return data, err
 
-    def go_farther_upstream(self, tech_flow_list, params, depth, max_depth):
-        depth += 1
-        if depth > max_depth:
-            return
+    def go_farther_upstream(self, tech_flow_list: list, params: dict, total=None,
+                            limits: Optional[UpstreamLimits] = None, lines=None) -> int:
+        """
+        Expands the upstream tree below the given top-level tech flows of an
+        impact category, level by level. The paths of one level are sent as
+        one batch; the sub-lists are attached to their tech flows as
+        `upstreamTechFlows`.
 
-        indent = ""
-        for _ in range(0, depth):
-            indent += "  - "
+        Parameters
+        ----------
+        tech_flow_list: list
+            The `result/upstream-impacts-of` response for the root path.
 
+        params: dict
+            The parameters of the root request, i.e. the result `@id` and the
+            `impactCategory`; it is not modified.
+
+        total: float, optional
+            The category total that `limits.min_share` refers to.
+
+        limits: UpstreamLimits, optional
+            The limits of the traversal; optional, defaults to
+            `self.upstream_limits`.
+
+        lines: list, optional
+            If given, the output lines are collected in this list instead of
+            being printed, so that categories exported in parallel can be
+            printed in order.
+
+        Returns the number of expanded tech flows, i.e. of requests sent.
+        """
+        if limits is None:
+            limits = self.upstream_limits
+        expanded = 0
+        # (tech flow, path of its parent, list that contains it)
+        level = [(tech_flow, '', tech_flow_list) for tech_flow in list(tech_flow_list)]
+        for _ in range(limits.max_depth):
+            candidates = []
+            for tech_flow, parent_path, siblings in level:
+                path = upstream_path(tech_flow, parent_path)
+                if path is None or not limits.is_relevant(tech_flow.get("result"), total):
+                    continue
+                candidates.append((tech_flow, path, siblings))
+            if limits.max_nodes is not None and len(candidates) > limits.max_nodes - expanded:
+                # The largest contributions are expanded first
+                room = max(0, limits.max_nodes - expanded)
+                largest = sorted(range(len(candidates)),
+                                 key=lambda i: -abs(candidates[i][0].get("result") or 0))[:room]
+                candidates = [candidates[i] for i in sorted(largest)]
+            if len(candidates) == 0:
+                break
+
+            calls = [("result/upstream-impacts-of", dict(params, path=path)) for _, path, _ in candidates]
+            responses = self.batch(calls)
+            expanded += len(candidates)
+
+            level = []
+            for (tech_flow, path, siblings), (sub_tech_flow_list, err) in zip(candidates, responses):
+                if sub_tech_flow_list is not None:
+                    tech_flow["upstreamTechFlows"] = sub_tech_flow_list
+                    level.extend((sub_tech_flow, path, sub_tech_flow_list)
+                                 for sub_tech_flow in list(sub_tech_flow_list))
+                else:
+                    siblings.append({"result/upstream-of-impact-category": err})
+
+        self.__print_upstream(tech_flow_list, 1, limits.max_depth, lines)
+        return expanded
+
+    def __print_upstream(self, tech_flow_list: list, depth: int, max_depth: int, lines=None):
+        if depth > max_depth:
+            return
+        indent = "  - " * depth
         for tech_flow in tech_flow_list:
             tech_flow_kernel = tech_flow.get("techFlow")
             if tech_flow_kernel is None:
-                return
-            result = tech_flow.get("result")
-            provider = tech_flow_kernel.get("provider")
-            if provider is None:
-                return
-            provider_id = provider["@id"]
-            provider_name = provider["name"]
-            flow = tech_flow_kernel.get("flow")
-            if flow is None:
-                return
-            flow_id = flow["@id"]
-            flow_name = flow["name"]
-            path = provider_id + "::" + flow_id
-            params["path"] = path
-
-            print("{indent}{provider} :: {flow} : {result}".format(indent=indent, provider=provider_name, flow=flow_name, result=result), flush=True)
-            # (sub_tech_flow_list, err) = self.__post("result/upstream-of-impact-category", params)
-            (sub_tech_flow_list, err) = self.__post("result/upstream-impacts-of", params)
-            if sub_tech_flow_list is not None:
-                self.go_farther_upstream(sub_tech_flow_list, params, depth=depth, max_depth=MAX_DEPTH)
-                tech_flow["upstreamTechFlows"] = sub_tech_flow_list
+                continue
+            provider_name = (tech_flow_kernel.get("provider") or {}).get("name")
+            flow_name = (tech_flow_kernel.get("flow") or {}).get("name")
+            line = "{indent}{provider} :: {flow} : {result}".format(
+                indent=indent, provider=provider_name, flow=flow_name, result=tech_flow.get("result"))
+            if lines is None:
+                print(line, flush=True)
             else:
-                tech_flow_list.append({"result/upstream-of-impact-category": err})
+                lines.append(line)
+            sub_tech_flow_list = tech_flow.get("upstreamTechFlows")
+            if sub_tech_flow_list is not None:
+                self.__print_upstream(sub_tech_flow_list, depth + 1, max_depth, lines)
 
     def json_export_upstream_of_impact_category(self, impact_params: dict, directory_path: str, file_prefix: str):
         suffix = "-result-upstream-of-impact-category"
@@ -682,46 +1025,217 @@ class Client(object):
         file_path = os.path.join(directory_path, file_name)
         file = open(file_path, "w")
 
-        params = {}
-        params["@id"] = impact_params["@id"]
-
-        upstream_of = []
+        # The top level of every impact category is fetched in one batch
+        calls = []
         for impact in impact_params["totalImpacts"]:
+            params = {}
+            params["@id"] = impact_params["@id"]
             params["path"] = "/"
             params["impactCategory"] = impact["impactCategory"]
+            calls.append(("result/upstream-impacts-of", params))
+        responses = self.batch(calls)
+
+        # The deeper levels of the impact categories are fetched in parallel, with at most
+        # export_concurrency categories in flight over all calculation workers that share this
+        # client; the output keeps the order of the categories
+        def upstream_of_category(item):
+            impact, (_, params), (tech_flow_list, err) = item
             impact_category_name = impact["impactCategory"]["name"]
             amount = impact["amount"]
-            print("------------------", flush=True)
-            print("{name}: {amount}".format(name=impact_category_name, amount=amount), flush=True)
-            # (tech_flow_list, err) = self.__post("result/upstream-of-impact-category", params)
-            (tech_flow_list, err) = self.__post("result/upstream-impacts-of", params)
+            lines = ["------------------", "{name}: {amount}".format(name=impact_category_name, amount=amount)]
             if tech_flow_list is not None:
-                self.go_farther_upstream(tech_flow_list, params, depth=0, max_depth=MAX_DEPTH)
-                upstream_of.append({impact_category_name: tech_flow_list})
+                with self.export_slots:
+                    self.go_farther_upstream(tech_flow_list, params, total=amount, lines=lines)
+                return {impact_category_name: tech_flow_list}, lines
             else:
-                upstream_of.append({"result/upstream-of-impact-category": err})
+                return {"result/upstream-of-impact-category": err}, lines
+
+        items = list(zip(impact_params["totalImpacts"], calls, responses))
+        upstream_of = []
+        if len(items) > 0:
+            workers = max(1, min(self.export_concurrency, len(items)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for entry, lines in executor.map(upstream_of_category, items):
+                    for line in lines:
+                        print(line, flush=True)
+                    upstream_of.append(entry)
 
         file.write(json.dumps(upstream_of, indent=4))
         file.close()
 
+    def shared_upstream_tree(self, impact_params: dict,
+                             limits: Optional[UpstreamLimits] = None) -> dict:
+        """
+        Returns the upstream trees of all impact categories of a result as
+        one tree with a vector of results per node, one value per impact
+        category in the order of `impact_params["totalImpacts"]`.
+
+        The IPC server has no endpoint that returns the upstream results of
+        several impact categories at once, so the tree is expanded level by
+        level like in `go_farther_upstream`, but the topology is discovered
+        only once: each node is first queried for the first impact category
+        in which it is relevant, and the other relevant categories are only
+        queried for the nodes that turned out to have children. A result is
+        `None` where a node was not queried for a category, e.g. because its
+        parent was pruned there.
+
+        The requests are therefore only saved for the nodes without children
+        and, with a `min_share` above 0, for the categories in which a node
+        is not relevant; an expanded node with children is still queried once
+        per category in which it is relevant, as the children's values of a
+        category are only returned by the query of that category.
+
+        Parameters
+        ----------
+        impact_params: dict
+            The result `@id` and the `totalImpacts` of the result.
+
+        limits: UpstreamLimits, optional
+            The limits of the traversal; optional, defaults to
+            `self.upstream_limits`. A node is expanded if it is relevant in
+            at least one impact category, and `max_nodes` limits the number
+            of expanded nodes of the whole tree.
+
+        Returns
+        -------
+        dict
+            The `impactCategories` with their amounts, the `upstreamTree` and
+            the number of `requests` sent.
+        """
+        if limits is None:
+            limits = self.upstream_limits
+        method = "result/upstream-impacts-of"
+        impacts = impact_params["totalImpacts"]
+        count = len(impacts)
+        totals = [impact["amount"] for impact in impacts]
+        base_params = [{"@id": impact_params["@id"], "impactCategory": impact["impactCategory"]}
+                       for impact in impacts]
+
+        def add_error(node: dict, category_index: int, err):
+            name = impacts[category_index]["impactCategory"]["name"]
+            node.setdefault("errors", {})[name] = err
+
+        tree = {
+            "impactCategories": [{"impactCategory": impact["impactCategory"], "amount": impact["amount"]}
+                                 for impact in impacts],
+            "upstreamTree": [],
+        }
+        roots = {}
+        responses = self.batch([(method, dict(params, path="/")) for params in base_params])
+        for k, (tech_flow_list, err) in enumerate(responses):
+            if tech_flow_list is not None:
+                merge_tech_flows(roots, tech_flow_list, k, count)
+            else:
+                add_error(tree, k, err)
+        tree["upstreamTree"] = list(roots.values())
+        requests_sent = len(responses)
+
+        expanded = 0
+        level = list(roots.items())
+        for _ in range(limits.max_depth):
+            # (node, path, categories in which it is relevant)
+            candidates = []
+            for path, node in level:
+                categories = [k for k, result in enumerate(node["results"])
+                              if result is not None and limits.is_relevant(result, totals[k])]
+                if len(categories) > 0:
+                    candidates.append((node, path, categories))
+            if limits.max_nodes is not None and len(candidates) > limits.max_nodes - expanded:
+                # The largest contributions are expanded first
+                room = max(0, limits.max_nodes - expanded)
+                largest = sorted(range(len(candidates)), key=lambda i: -max(
+                    share_of(candidates[i][0]["results"][k], totals[k]) for k in candidates[i][2]))[:room]
+                candidates = [candidates[i] for i in sorted(largest)]
+            if len(candidates) == 0:
+                break
+
+            # The topology of the level, from the first relevant category of each node
+            children = [None] * len(candidates)
+            calls, call_targets = [], []
+            responses = self.batch([(method, dict(base_params[categories[0]], path=path))
+                                    for _, path, categories in candidates])
+            for i, ((node, path, categories), (tech_flow_list, err)) in enumerate(zip(candidates, responses)):
+                if tech_flow_list is None:
+                    add_error(node, categories[0], err)
+                    continue
+                children[i] = {}
+                merge_tech_flows(children[i], tech_flow_list, categories[0], count)
+                if len(tech_flow_list) > 0:
+                    for k in categories[1:]:
+                        calls.append((method, dict(base_params[k], path=path)))
+                        call_targets.append((i, k))
+
+            # The values of the other categories, only for the nodes with children
+            for (i, k), (tech_flow_list, err) in zip(call_targets, self.batch(calls)):
+                if tech_flow_list is not None:
+                    merge_tech_flows(children[i], tech_flow_list, k, count)
+                else:
+                    add_error(candidates[i][0], k, err)
+            requests_sent += len(candidates) + len(calls)
+            expanded += len(candidates)
+
+            level = []
+            for (node, path, _), nodes in zip(candidates, children):
+                if nodes is None:
+                    continue
+                node["upstreamTechFlows"] = list(nodes.values())
+                level.extend((path + "/" + key, child) for key, child in nodes.items())
+
+        tree["requests"] = requests_sent
+        return tree
+
+    def json_export_shared_upstream_tree(self, impact_params: dict, directory_path: str, file_prefix: str):
+        """
+        Writes the `shared_upstream_tree` of a result to
+        `<file_prefix>-result-upstream-tree.json`; it replaces the per
+        category trees of `json_export_upstream_of_impact_category`.
+        """
+        suffix = "-result-upstream-tree"
+        file_name = f"{file_prefix}{suffix}.json"
+        file_path = os.path.join(directory_path, file_name)
+
+        tree = self.shared_upstream_tree(impact_params)
+        print("Upstream tree of {n} impact categories: {requests} requests".format(
+            n=len(tree["impactCategories"]), requests=tree["requests"]), flush=True)
+        self.__print_shared_upstream(tree["upstreamTree"], 1, self.upstream_limits.max_depth)
+
+        with open(file_path, "w") as file:
+            file.write(json.dumps(tree, indent=4))
+
+    def __print_shared_upstream(self, nodes: list, depth: int, max_depth: int):
+        if depth > max_depth:
+            return
+        indent = "  - " * depth
+        for node in nodes:
+            tech_flow_kernel = node["techFlow"]
+            provider_name = (tech_flow_kernel.get("provider") or {}).get("name")
+            flow_name = (tech_flow_kernel.get("flow") or {}).get("name")
+            print("{indent}{provider} :: {flow} : {results}".format(
+                indent=indent, provider=provider_name, flow=flow_name, results=node["results"]), flush=True)
+            self.__print_shared_upstream(node.get("upstreamTechFlows", []), depth + 1, max_depth)
+
     def json_export_flows_of_impact_category(self, impact_params: dict, directory_path: str, file_prefix: str):
         suffix = "-result-flows-of-impact-category"
         file_name = f"{file_prefix}{suffix}.json"
         file_path = os.path.join(directory_path, file_name)
         file = open(file_path, "w")
 
-        params = {}
-        params["@id"] = impact_params["@id"]
-
-        flows_of = []
+        # All impact categories are fetched in one batch
+        calls = []
         for impact in impact_params["totalImpacts"]:
+            params = {}
+            params["@id"] = impact_params["@id"]
             params["path"] = "/"
             params["impactCategory"] = impact["impactCategory"]
+            calls.append(("result/flow-impacts-of", params))
+        responses = self.batch(calls)
+
+        flows_of = []
+        for impact, (flow_list, err) in zip(impact_params["totalImpacts"], responses):
             impact_category_name = impact["impactCategory"]["name"]
             amount = impact["amount"]
             print("------------------", flush=True)
             print("{name}: {amount}".format(name=impact_category_name, amount=amount), flush=True)
-            (flow_list, err) = self.__post("result/flow-impacts-of", params)
 
             if flow_list is not None:
                 flows_of.append({impact_category_name: flow_list})
@@ -855,6 +1369,7 @@ class Client(object):
         if err:
             log.error('failed to create product system: %s', err)
             return None
+        self.__index_put('ProductSystem', r)
         return schema.Ref.from_json(r)
 
     def lci_inputs(self, result: schema.SimpleResult) -> List[schema.FlowResult]:
@@ -1215,22 +1730,173 @@ class Client(object):
             return None
         return utree.UpstreamTree.from_json(raw)
 
+    def rpc(self, method: str, params) -> Tuple[Any, Optional[str]]:
+        """
+        Call the given JSON-RPC method of the IPC server.
+
+        This is the raw protocol access used by the other methods of this
+        client, e.g. `client.rpc('result/total-impacts', {'@id': result_id})`.
+        It returns a tuple (result, error).
+        """
+        return self.__post(method, params)
+
+    def batch(self, calls: List[Tuple[str, Any]]) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Call several JSON-RPC methods in one HTTP request (a JSON-RPC 2.0
+        batch) and match the responses back to the calls by their IDs.
+
+        If the server does not accept batch requests, the calls are sent as
+        single requests over the pooled connections instead, concurrently
+        with at most `pool_size` in flight, and later batches go the same way.
+        A batch is sent once, without retries; when it fails, the calls are
+        sent as single requests only if they are all read-only, otherwise
+        every call returns the error as the writes may have been applied.
+        Batching is only turned off for later calls when the server rejected
+        the batch, not after a network error or timeout.
+
+        Parameters
+        ----------
+        calls: List[Tuple[str, Any]]
+            The (method, params) pairs of the calls.
+
+        Returns
+        -------
+        List[Tuple[Any, Optional[str]]]
+            A tuple (result, error) for each call, in the order of `calls`.
+
+        Example
+        -------
+        ```python
+        calls = [('result/flow-impacts-of', {'@id': result_id, 'impactCategory': i})
+                 for i in impact_categories]
+        for data, err in client.batch(calls):
+            ...
+        ```
+        """
+        if len(calls) == 0:
+            return []
+        if not self.batch_supported or len(calls) == 1:
+            return self.__post_each(calls)
+
+        reqs = []
+        for method, params in calls:
+            reqs.append(self.__request(method, params))
+        read_only = all(is_read_only(method) for method, _ in calls)
+        resp, err, error = self.__send_payload(reqs, 'batch', False)
+        if err:
+            if isinstance(error, (requests.HTTPError, ValueError)):
+                # An HTTP error status or a response that is not JSON: the
+                # server rejects batches, so single requests are used from now
+                # on; a network error or timeout only affects this batch
+                self.batch_supported = False
+            if not read_only:
+                log.error('JSON-RPC batch with writes failed, not sending it again: %s', err)
+                return [(None, err) for _ in calls]
+            log.warning('JSON-RPC batch failed, sending single requests: %s', err)
+            return self.__post_each(calls)
+
+        if not isinstance(resp, list):
+            # Batch requests are not supported by this server
+            log.info('IPC server does not accept JSON-RPC batches, sending single requests')
+            self.batch_supported = False
+            return self.__post_each(calls)
+
+        resps_by_id = {}
+        for r in resp:
+            if isinstance(r, dict):
+                resps_by_id[r.get('id')] = r
+        results = []
+        for (method, _), req in zip(calls, reqs):
+            r = resps_by_id.get(req['id'])
+            if r is None:
+                results.append((None, 'No response for %s in JSON-RPC batch' % method))
+            else:
+                results.append(self.__result_of(method, r))
+        return results
+
+    def __post_each(self, calls: List[Tuple[str, Any]]) -> List[Tuple[Any, Optional[str]]]:
+        def post_one(call: Tuple[str, Any]):
+            return self.__post(call[0], call[1])
+
+        workers = max(1, min(self.pool_size, len(calls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(post_one, calls))
+
     def __post(self, method: str, params) -> Tuple[Any, Optional[str]]:
         """
         Performs a request with the given parameters.
 
         It returns a tuple (result, error).
         """
-        req = {
+        resp, err = self.__send(self.__request(method, params), method, is_read_only(method))
+        if err:
+            return None, err
+        return self.__result_of(method, resp)
+
+    def __request(self, method: str, params) -> dict:
+        with self.id_lock:
+            request_id = self.next_id
+            self.next_id += 1
+        return {
             'jsonrpc': '2.0',
-            'id': self.next_id,
+            'id': request_id,
             'method': method,
             'params': params
         }
-        self.next_id += 1
-        resp = requests.post(self.url, json=req).json()  # type: dict
+
+    def __send(self, payload, label: str, read_only: bool) -> Tuple[Any, Optional[str]]:
+        """
+        Sends the JSON payload and returns the decoded response body.
+
+        Connection errors, timeouts and 5xx responses of read-only requests
+        are retried according to `retries` and `retry_backoff`; a call that
+        failed after its last attempt is counted per method (or 'batch') in
+        `failure_counts`.
+
+        It returns a tuple (response, error).
+        """
+        resp, err, _ = self.__send_payload(payload, label, read_only)
+        return resp, err
+
+    def __send_payload(self, payload, label: str, read_only: bool) -> Tuple[Any, Optional[str], Optional[Exception]]:
+        # Like `__send`, plus the exception of the last failed attempt
+        attempts = 1 + self.retries if read_only else 1
+        delays = self.retry_backoff.delays()
+        for attempt in range(1, attempts + 1):
+            self.circuit_breaker.before_call()
+            try:
+                http_resp = self.session.post(
+                    self.url, json=payload, timeout=self.timeout)
+                if http_resp.status_code >= 500:
+                    raise requests.HTTPError(
+                        'HTTP %i' % http_resp.status_code, response=http_resp)
+                resp = http_resp.json()
+            except (requests.RequestException, ValueError) as e:
+                self.circuit_breaker.record_failure()
+                if attempt < attempts:
+                    delay = next(delays)
+                    log.warning('%s failed (attempt %i of %i), retrying in %.1f s: %s',
+                                label, attempt, attempts, delay, e)
+                    time.sleep(delay)
+                    continue
+                self.__count_failure(label)
+                return None, '%s failed: %s' % (label, e), e
+            except BaseException:
+                # Releases the calls waiting for a half-open probe
+                self.circuit_breaker.record_failure()
+                raise
+            self.circuit_breaker.record_success()
+            return resp, None, None
+
+    def __count_failure(self, label: str):
+        # Called from the threads of `get_many`, `batch` and the exports
+        with self.failure_counts_lock:
+            self.failure_counts[label] += 1
+
+    def __result_of(self, method: str, resp: dict) -> Tuple[Any, Optional[str]]:
         err = resp.get('error')  # type: dict
         if err is not None:
+            self.__count_failure(method)
             err_msg = '%i: %s' % (err.get('code'), err.get('message'))
             return None, err_msg
         result = resp.get('result')
@@ -0,0 +1,42 @@
+import random
+
+from dataclasses import dataclass
+from typing import Iterator
+
+
+@dataclass
+class Backoff:
+    """
+    An exponential backoff policy: the first delay is `initial` seconds and
+    each following delay is `factor` times longer, up to `max_delay`.
+
+    Attributes
+    ----------
+    initial: float
+        The first delay in seconds.
+
+    factor: float
+        The growth factor between two delays.
+
+    max_delay: float
+        The upper bound of a single delay in seconds.
+
+    jitter: float
+        The fraction of each delay that is randomized, e.g. 0.5 gives delays
+        between 50% and 100% of the computed value. 0 means no jitter.
+    """
+
+    initial: float = 0.005
+    factor: float = 2.0
+    max_delay: float = 2.0
+    jitter: float = 0.0
+
+    def delays(self) -> Iterator[float]:
+        """Returns an endless iterator of delays in seconds."""
+        delay = self.initial
+        while True:
+            if self.jitter > 0:
+                yield delay * (1.0 - self.jitter * random.random())
+            else:
+                yield delay
+            delay = min(delay * self.factor, self.max_delay)
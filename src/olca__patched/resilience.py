@@ -0,0 +1,107 @@
+import logging as log
+import threading
+import time
+
+from typing import Optional
+
+
+# JSON-RPC methods under the read-only prefixes that change server state and
+# must therefore not be sent twice
+_NON_IDEMPOTENT_METHODS = {
+    'result/calculate',
+    'result/simulate',
+    'result/simulate/next',
+    'result/dispose',
+}
+
+_READ_ONLY_PREFIXES = (
+    'data/get',
+    'get/',
+    'result/',
+)
+
+
+def is_read_only(method: str) -> bool:
+    """
+    Returns `True` if the given JSON-RPC method only reads data from the IPC
+    server, so that it is safe to retry it after a transient failure.
+    """
+    if method in _NON_IDEMPOTENT_METHODS:
+        return False
+    return method.startswith(_READ_ONLY_PREFIXES)
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for the calls to an IPC server.
+
+    After `failure_threshold` consecutive transport failures the breaker
+    opens: the next call is paused until `reset_timeout` seconds have passed,
+    which pauses the pipeline instead of failing every following call while
+    the server is unhealthy. That call is then let through as a probe; a
+    success closes the breaker again, a failure re-opens it.
+
+    Parameters
+    ----------
+    failure_threshold: int, optional
+        The number of consecutive failures that open the breaker; optional,
+        defaults to 5.
+
+    reset_timeout: float, optional
+        The number of seconds the breaker stays open; optional, defaults to
+        30.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        # The start of the single call that is let through when the reset
+        # timeout has passed, see `before_call`; every call must be recorded
+        # as a success or a failure so that the waiting calls are released
+        self.probe_started_at: Optional[float] = None
+        self.__condition = threading.Condition()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self):
+        """
+        Blocks while the breaker is open. When the reset timeout has passed a
+        single call is let through as a probe; the other calls wait until the
+        probe was recorded as a success or a failure.
+        """
+        with self.__condition:
+            while self.opened_at is not None:
+                now = time.monotonic()
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    print(f"IPC server unhealthy, pausing for {remaining:.1f} s", flush=True)
+                    self.__condition.wait(remaining)
+                    continue
+                if self.probe_started_at is None:
+                    self.probe_started_at = now
+                    return
+                self.__condition.wait()
+
+    def record_success(self):
+        with self.__condition:
+            if self.opened_at is not None:
+                log.info('IPC server healthy again, closing circuit breaker')
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+            self.__condition.notify_all()
+
+    def record_failure(self):
+        with self.__condition:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log.warning('%i consecutive IPC failures, opening circuit breaker',
+                                self.consecutive_failures)
+                self.opened_at = time.monotonic()
+            self.probe_started_at = None
+            self.__condition.notify_all()
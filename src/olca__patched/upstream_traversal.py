@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass
+class UpstreamLimits:
+    """
+    The limits of the upstream traversal of an impact category result, see
+    `Client.go_farther_upstream`.
+
+    Attributes
+    ----------
+    max_depth: int
+        The number of levels below the top-level tech flows that are
+        expanded.
+
+    min_share: float
+        The minimum share of the category total, as a fraction (e.g. 0.01 for
+        1%), that the result of a tech flow must have to be expanded. 0 means
+        that every tech flow is expanded.
+
+    max_nodes: int, optional
+        The maximum number of tech flows that are expanded per impact
+        category, i.e. the maximum number of `result/upstream-impacts-of`
+        calls. `None` means no limit. When the limit is reached within a
+        level, the tech flows with the largest contributions are expanded
+        first.
+    """
+
+    max_depth: int = 2
+    min_share: float = 0.0
+    max_nodes: Optional[int] = None
+
+    def is_relevant(self, result, total) -> bool:
+        """
+        Returns `True` if a tech flow with the given result is large enough,
+        compared to the category total, to be expanded.
+        """
+        if self.min_share <= 0 or not total:
+            return True
+        if result is None:
+            return False
+        return abs(result) >= self.min_share * abs(total)
+
+
+def share_of(result, total) -> float:
+    """
+    Returns the absolute share of the result in the category total, or the
+    absolute result if the total is 0.
+    """
+    if result is None:
+        return 0.0
+    if not total:
+        return abs(result)
+    return abs(result) / abs(total)
+
+
+def upstream_path(tech_flow: dict, parent_path: str = '') -> Optional[str]:
+    """
+    Returns the path of the given tech flow in the upstream tree, i.e.
+    `<provider1_id>::<flow1_id>/<provider2_id>::<flow2_id>/...`, or `None` if
+    the tech flow has no provider or flow.
+    """
+    tech_flow_kernel = tech_flow.get('techFlow')
+    if tech_flow_kernel is None:
+        return None
+    provider = tech_flow_kernel.get('provider')
+    flow = tech_flow_kernel.get('flow')
+    if provider is None or flow is None:
+        return None
+    segment = provider['@id'] + '::' + flow['@id']
+    if not parent_path:
+        return segment
+    return parent_path + '/' + segment
+
+
+def merge_tech_flows(nodes: Dict[str, dict], tech_flow_list: List[dict],
+                     category_index: int, category_count: int):
+    """
+    Merges the `result/upstream-impacts-of` response of one impact category
+    into the nodes of a shared upstream tree, keyed by
+    `<provider_id>::<flow_id>`. Each node holds the tech flow and a vector of
+    `category_count` results, one per impact category; results that were not
+    queried stay `None`.
+    """
+    for tech_flow in tech_flow_list:
+        key = upstream_path(tech_flow)
+        if key is None:
+            continue
+        node = nodes.get(key)
+        if node is None:
+            node = {'techFlow': tech_flow['techFlow'], 'results': [None] * category_count}
+            nodes[key] = node
+        node['results'][category_index] = tech_flow.get('result')